@@ -0,0 +1,132 @@
+import os
+import logging
+import threading
+import boto3
+from botocore.config import Config
+from botocore.credentials import CredentialProvider, RefreshableCredentials
+from botocore.session import get_session as get_botocore_session
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Sized above the widest thread pool (Force Flow prefetch, multipart uploads, fingerprint HEADs)
+# so concurrent requests are not queued behind botocore's default pool of 10
+max_pool_connections = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '32'))
+client_config = Config(
+    max_pool_connections=max_pool_connections,
+    retries={'max_attempts': 5, 'mode': 'standard'}
+)
+
+# Clients and resources created in this container, keyed by service, session and arguments
+_cache = {}
+_sessions = {}
+_lock = threading.Lock()
+
+
+class AssumeRoleCredentialProvider(CredentialProvider):
+    """Credential provider that assumes a role and refreshes it shortly before it expires.
+
+    botocore's default refresh windows (15 and 10 minutes) would re-assume the role on
+    every call for 900-second sessions, so narrower ones are passed to the credentials.
+    """
+    METHOD = 'sts-assume-role'
+
+    def __init__(self, refresh_using):
+        super().__init__()
+        self._refresh_using = refresh_using
+
+    def load(self):
+        return RefreshableCredentials.create_from_metadata(
+            metadata=self._refresh_using(),
+            refresh_using=self._refresh_using,
+            method=self.METHOD,
+            advisory_timeout=5 * 60,
+            mandatory_timeout=2 * 60
+        )
+
+
+def _get_or_create(kind, service_name, session=None, **kwargs):
+    key = (kind, service_name, session, tuple(sorted(kwargs.items())))
+    with _lock:
+        if key not in _cache:
+            logger.info(f"Creating boto3 {kind} for {service_name}")
+            factory = getattr(session or boto3, kind)
+            _cache[key] = factory(service_name, config=client_config, **kwargs)
+        return _cache[key]
+
+
+def get_client(service_name, **kwargs):
+    """Return the container-wide boto3 client for a service, creating it on first use."""
+    return _get_or_create('client', service_name, **kwargs)
+
+
+def get_resource(service_name, **kwargs):
+    """Return the container-wide boto3 resource for a service, creating it on first use."""
+    return _get_or_create('resource', service_name, **kwargs)
+
+
+def get_assumed_role_session(role_arn, session_name, duration_seconds=900):
+    """Return a boto3 Session whose credentials come from assuming `role_arn`.
+
+    Creating the session makes no STS call; the role is assumed when the session first
+    resolves credentials (as its first client is created), and the credentials are
+    cached and refreshed by botocore.
+    """
+    def refresh():
+        logger.info(f"Assuming role {role_arn}")
+        credentials = get_client('sts').assume_role(
+            RoleArn=role_arn,
+            RoleSessionName=session_name,
+            DurationSeconds=duration_seconds
+        )['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat()
+        }
+
+    key = (role_arn, session_name, duration_seconds)
+    with _lock:
+        if key not in _sessions:
+            botocore_session = get_botocore_session()
+            # Consulted ahead of the environment (the Lambda's own role) in the default chain
+            botocore_session.get_component('credential_provider').insert_before('env', AssumeRoleCredentialProvider(refresh))
+            _sessions[key] = boto3.Session(botocore_session=botocore_session)
+        return _sessions[key]
+
+
+def get_assumed_role_client(service_name, role_arn, session_name, duration_seconds=900, **kwargs):
+    """Return the container-wide client for a service using credentials from assuming `role_arn`."""
+    session = get_assumed_role_session(role_arn, session_name, duration_seconds)
+    return _get_or_create('client', service_name, session=session, **kwargs)
+
+
+class LazyClient:
+    """Module-level stand-in for a boto3 client or resource.
+
+    Nothing is created at import time; the first attribute access builds (or reuses)
+    the cached client, so Lambdas only pay for the clients their handler touches.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+
+def lazy_client(service_name, **kwargs):
+    """Lazy equivalent of boto3.client(service_name, **kwargs) using the shared config."""
+    return LazyClient(lambda: get_client(service_name, **kwargs))
+
+
+def lazy_resource(service_name, **kwargs):
+    """Lazy equivalent of boto3.resource(service_name, **kwargs) using the shared config."""
+    return LazyClient(lambda: get_resource(service_name, **kwargs))
+
+
+def lazy_assumed_role_client(service_name, role_arn, session_name, duration_seconds=900, **kwargs):
+    """Lazy client whose credentials come from assuming `role_arn`; see get_assumed_role_session."""
+    return LazyClient(lambda: get_assumed_role_client(service_name, role_arn, session_name, duration_seconds, **kwargs))
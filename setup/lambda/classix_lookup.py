@@ -0,0 +1,66 @@
+import os
+import logging
+from functools import lru_cache
+import pandas as pd
+from schema_registry import get_input_dtypes
+from s3_utils import use_arrow, arrow_dtypes, arrow_types_mapper
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Class IX dimensional data copied into the image, and the prepared lookup built from it at image build time
+classix_csv_path = os.getenv('CLASSIX_DIMENSIONAL_DATA_PATH', '/var/task/classix_dimensional_data.csv')
+classix_lookup_path = os.getenv('CLASSIX_LOOKUP_PATH', '/var/task/classix_dimensional_data.feather')
+
+
+def prepare_classix_lookup(df):
+    """Rename, keep distinct rows per NIIN and Nomenclature, upper-case the headers and order by NIIN."""
+    df = df.rename(columns={
+        "UNIT_PRICE": "Unit_Price",
+        "NOMENCLATURE": "Nomenclature"
+    }).drop_duplicates(subset=["NIIN", "Nomenclature"])
+
+    # Convert all column names to uppercase
+    df.columns = df.columns.str.upper()
+
+    # Stable sort keeps the file order among rows that share a NIIN, so merges match the CSV lookup
+    return df.sort_values('NIIN', kind='stable').reset_index(drop=True)
+
+
+def read_classix_csv(csv_path=classix_csv_path):
+    """Parse the dimensional data CSV with the registered schema and prepare it for lookups."""
+    dtype = get_input_dtypes('classix_dimensional_data')
+    if use_arrow():
+        return prepare_classix_lookup(pd.read_csv(csv_path, dtype=arrow_dtypes(dtype), dtype_backend='pyarrow'))
+    return prepare_classix_lookup(pd.read_csv(csv_path, dtype=dtype))
+
+
+def build_classix_lookup(csv_path=classix_csv_path, lookup_path=classix_lookup_path):
+    """Write the prepared lookup as Feather; run while building the image."""
+    df = read_classix_csv(csv_path)
+    df.to_feather(lookup_path)
+    logger.info(f"Wrote Class IX lookup with {len(df)} rows to {lookup_path}")
+
+
+@lru_cache(maxsize=None)
+def load_classix_lookup():
+    """Return the prepared Class IX dimensional lookup, loaded once per container.
+
+    Reads the Feather file built into the image; when it is missing (e.g. running
+    outside the image) the CSV is parsed instead. Callers must not modify the frame.
+    """
+    if os.path.exists(classix_lookup_path):
+        logger.info(f"Loading Class IX lookup from {classix_lookup_path}")
+        if use_arrow():
+            import pyarrow.feather as feather
+            return feather.read_table(classix_lookup_path).to_pandas(types_mapper=arrow_types_mapper())
+        return pd.read_feather(classix_lookup_path)
+
+    logger.info(f"{classix_lookup_path} not found, parsing {classix_csv_path}")
+    return read_classix_csv()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    build_classix_lookup()
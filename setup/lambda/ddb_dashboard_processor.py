@@ -3,7 +3,7 @@ import json
 import logging
 import shutil
 from datetime import datetime
-import boto3
+from aws_clients import lazy_client, lazy_resource
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key, Attr
 from tenacity import retry, stop_after_attempt, wait_exponential
@@ -13,10 +13,10 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # Initialize clients
-s3_client = boto3.client('s3')
-dynamodb_client = boto3.client('dynamodb')
-dynamodb_resource = boto3.resource('dynamodb', region_name='us-east-1')
-quicksight_client = boto3.client('quicksight')
+s3_client = lazy_client('s3')
+dynamodb_client = lazy_client('dynamodb')
+dynamodb_resource = lazy_resource('dynamodb', region_name='us-east-1')
+quicksight_client = lazy_client('quicksight')
 
 # Configuration
 dynamodb_table = os.getenv('DYNAMODB_TABLE', 'imat-dashboard-datasets')
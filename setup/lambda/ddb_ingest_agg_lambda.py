@@ -5,7 +5,7 @@ import time
 import csv
 from io import StringIO
 from datetime import datetime, timezone
-import boto3
+from aws_clients import lazy_client, lazy_resource
 from botocore.exceptions import ClientError
 
 
@@ -14,10 +14,10 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # Initialize clients
-s3_client = boto3.client('s3')
-dynamodb_client = boto3.client('dynamodb')
-dynamodb_resource = boto3.resource('dynamodb', region_name='us-east-1')
-quicksight_client = boto3.client('quicksight')
+s3_client = lazy_client('s3')
+dynamodb_client = lazy_client('dynamodb')
+dynamodb_resource = lazy_resource('dynamodb', region_name='us-east-1')
+quicksight_client = lazy_client('quicksight')
 
 # Configuration
 aws_account_id = os.getenv('AWS_ACCOUNT_ID', 'xxxxxxxxxxxx')
@@ -26,14 +26,24 @@ dynamodb_table = os.getenv('DYNAMODB_TABLE', 'imat-dashboard-datasets')
 source_bucket = os.environ.get('SOURCE_BUCKET', '{bucket_name}')
 
 
+def s3_object_exists(bucket_name, file_key):
+    """
+    Return True when the object exists in S3.
+    """
+    try:
+        s3_client.head_object(Bucket=bucket_name, Key=file_key)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return False
+        raise
+
+
 def count_csv_rows(bucket_name, file_key):
     """
     Count the number of rows in a CSV file stored in S3.
     """
     try:
-        # Initialize S3 client
-        s3_client = boto3.client('s3')
-        
         # Fetch the file from S3
         response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
         
@@ -53,6 +63,27 @@ def count_csv_rows(bucket_name, file_key):
         return None
 
 
+def count_manifest_rows(bucket_name, manifest_key):
+    """
+    Count the rows of every CSV part listed in a parts manifest (aggregated_embark.manifest.json).
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=manifest_key)
+        entries = json.loads(response['Body'].read())['entries']
+    except Exception as e:
+        print(f"Error reading manifest: {str(e)}")
+        return None
+
+    row_count = 0
+    for entry in entries:
+        part_bucket, part_key = entry['url'].replace("s3://", "").split("/", 1)
+        part_rows = count_csv_rows(part_bucket, part_key)
+        if part_rows is None:
+            return None
+        row_count += part_rows
+    return row_count
+
+
 def get_dataset_row_count(quicksight_client, aws_account_id, dataset_id):
     """
     Get the number of rows ingested in a QuickSight dataset.
@@ -93,8 +124,11 @@ def compare_s3_and_quicksight_rows(quicksight_client, bucket_name, file_key, ass
     """
     try:
         
-        # Count rows in S3 file (aggregated_embark.csv)
-        s3_row_count = count_csv_rows(bucket_name, file_key)
+        # Count rows in S3 file (aggregated_embark.csv, or the parts its manifest lists)
+        if file_key.endswith('.manifest.json'):
+            s3_row_count = count_manifest_rows(bucket_name, file_key)
+        else:
+            s3_row_count = count_csv_rows(bucket_name, file_key)
         if s3_row_count is None:
             print("Failed to count rows in S3 CSV file.")
             return False
@@ -160,9 +194,11 @@ def create_ingestion(quicksight_client, aws_account_id, aggregated_dataset_id, a
             logger.error(f"Dataset {aggregated_dataset_id} does not exist.")
             return None, None
         
-        # Define the S3 bucket and file path
+        # Define the S3 bucket and file path; a partitioned aggregate is listed by its manifest
         bucket_name = source_bucket
-        file_key = f'assessments/{assessment_id}/aggregated_embark.csv'
+        file_key = f'assessments/{assessment_id}/aggregated_embark.manifest.json'
+        if not s3_object_exists(bucket_name, file_key):
+            file_key = f'assessments/{assessment_id}/aggregated_embark.csv'
         
         # Compare the number of rows between S3 and QuickSight dataset
         test = compare_s3_and_quicksight_rows(quicksight_client, bucket_name, file_key, assessment_id, aws_account_id)
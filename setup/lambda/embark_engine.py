@@ -0,0 +1,302 @@
+import os
+import re
+import json
+import string
+import logging
+from functools import lru_cache
+import numpy as np
+from schema_registry import read_input_csv
+from reshape_utils import wide_to_long, lookup_values
+from s3_utils import write_s3_csv, write_s3_parquet, input_fingerprint, is_output_current, fingerprint_metadata, S3PrefixIndex, use_arrow, numpy_frame
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Declarative per-class embark transforms copied into the image
+specs_path = os.getenv('EMBARK_SPECS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embark_specs.json'))
+
+# Bump when the engine changes how a spec is applied; specs carry their own version
+ENGINE_VERSION = '3'
+
+
+@lru_cache(maxsize=None)
+def load_specs():
+    """Load the embark specs once per container."""
+    with open(specs_path) as f:
+        return json.load(f)
+
+
+def get_spec(name):
+    """Return the spec for an embark class, e.g. 'cosiv'."""
+    specs = load_specs()
+    if name not in specs:
+        raise KeyError(f"No embark spec named {name}")
+    return specs[name]
+
+
+def spec_for_file(file_name):
+    """Return the name of the spec whose input file is `file_name`, or None."""
+    for name, spec in load_specs().items():
+        if spec['input'] == file_name:
+            return name
+    return None
+
+
+def transform_version(spec):
+    """Version recorded in the output fingerprint; changes to the engine or the spec rebuild outputs."""
+    return f"engine-{ENGINE_VERSION}/spec-{spec['version']}"
+
+
+def input_columns(read_spec):
+    """Build the read_s3_csv usecols argument from the spec's read section.
+
+    Plain column lists are passed straight to the parser; `patterns` (searched) and
+    `exclude` (searched) turn it into a predicate evaluated once per header name.
+    """
+    columns = read_spec.get('usecols')
+    patterns = [re.compile(p) for p in read_spec.get('patterns', [])]
+    exclude = [re.compile(p) for p in read_spec.get('exclude', [])]
+    if not patterns and not exclude:
+        return columns
+
+    names = set(columns or [])
+
+    def is_input_column(col):
+        if any(p.search(col) for p in exclude):
+            return False
+        return col in names or any(p.search(col) for p in patterns)
+
+    return is_input_column
+
+
+def eval_expr(df, expr):
+    """Evaluate a column expression; names with spaces or symbols are quoted with backticks.
+
+    pandas' eval cannot do arithmetic on Arrow-backed columns, so with the Arrow backend
+    the columns the expression names are converted to NumPy first.
+    """
+    if use_arrow():
+        df = numpy_frame(df[[col for col in df.columns if col in expr]])
+    return df.eval(expr, engine='python')
+
+
+def format_template(df, template):
+    """Vectorized str.format over columns: '{TAMCN}_Class_II/VII' -> TAMCN + '_Class_II/VII'."""
+    parts = []
+    for literal, field, _, _ in string.Formatter().parse(template):
+        if literal:
+            parts.append(literal)
+        if field:
+            parts.append(df[field].astype(str))
+    result = parts[0]
+    for part in parts[1:]:
+        result = result + part
+    return result
+
+
+# Compiled steps: each builder takes the step's parameters and returns a DataFrame -> DataFrame function
+
+def build_rename(step):
+    columns = step['columns']
+    return lambda df: df.rename(columns=columns)
+
+
+def build_rename_regex(step):
+    pattern = re.compile(step['pattern'])
+    repl = step['repl']
+
+    def apply(df):
+        df.columns = [pattern.sub(repl, col) for col in df.columns]
+        return df
+    return apply
+
+
+def build_upper_columns(step):
+    def apply(df):
+        df.columns = df.columns.str.upper()
+        return df
+    return apply
+
+
+def build_melt(step):
+    id_vars = step['id_vars']
+    value_vars = step['value_vars']
+    return lambda df: df.melt(id_vars=id_vars, value_vars=value_vars, var_name=step['var_name'], value_name=step['value_name'])
+
+
+def build_wide_to_long(step):
+    return lambda df: wide_to_long(df, id_vars=step['id_vars'], pattern=step['pattern'], group_name=step['group_name'], metric_name=step['metric_name'])
+
+
+def build_assign(step):
+    columns = step['columns']
+
+    def apply(df):
+        for column, expr in columns.items():
+            df[column] = eval_expr(df, expr)
+        return df
+    return apply
+
+
+def build_constant(step):
+    columns = step['columns']
+
+    def apply(df):
+        for column, value in columns.items():
+            df[column] = value
+        return df
+    return apply
+
+
+def build_format(step):
+    columns = step['columns']
+
+    def apply(df):
+        for column, template in columns.items():
+            df[column] = format_template(df, template)
+        return df
+    return apply
+
+
+def build_case(step):
+    """np.select over membership of `on`; each case sets an expression or a literal value."""
+    column, on, cases = step['column'], step['on'], step['cases']
+    default = step.get('default')
+    default = np.nan if default is None else default
+
+    def apply(df):
+        conditions = [df[on].isin(case['in']) for case in cases]
+        choices = [eval_expr(df, case['expr']) if 'expr' in case else case['value'] for case in cases]
+        df[column] = np.select(conditions, choices, default=default)
+        return df
+    return apply
+
+
+def build_lookup(step):
+    """Dict lookup on `key`, optionally multiplied by another column."""
+    column, key, values = step['column'], step['key'], step['values']
+    default = step.get('default', 0)
+    multiply = step.get('multiply')
+
+    def apply(df):
+        looked_up = lookup_values(df[key], values, default)
+        df[column] = looked_up if multiply is None else df[multiply] * looked_up
+        return df
+    return apply
+
+
+def build_fillna(step):
+    columns = step['columns']
+    value = step.get('value', 0)
+
+    def apply(df):
+        df[columns] = df[columns].fillna(value)
+        return df
+    return apply
+
+
+def build_filter(step):
+    """Keep rows where `expr` holds; specs filter on source columns before deriving new ones.
+
+    take() returns an independent frame, so later steps can add columns without
+    SettingWithCopy checks against the unfiltered input.
+    """
+    expr = step['expr']
+    return lambda df: df.take(np.flatnonzero(eval_expr(df, expr)))
+
+
+def build_select(step):
+    columns = step['columns']
+    return lambda df: df[columns]
+
+
+OPS = {
+    'rename': build_rename,
+    'rename_regex': build_rename_regex,
+    'upper_columns': build_upper_columns,
+    'melt': build_melt,
+    'wide_to_long': build_wide_to_long,
+    'assign': build_assign,
+    'constant': build_constant,
+    'format': build_format,
+    'case': build_case,
+    'lookup': build_lookup,
+    'fillna': build_fillna,
+    'filter': build_filter,
+    'select': build_select
+}
+
+
+@lru_cache(maxsize=None)
+def compile_spec(name):
+    """Compile a spec's steps once per container into a list of (op, function)."""
+    spec = get_spec(name)
+    compiled = []
+    for step in spec['steps']:
+        if step['op'] not in OPS:
+            raise ValueError(f"Unknown op {step['op']} in embark spec {name}")
+        compiled.append((step['op'], OPS[step['op']](step)))
+    return compiled
+
+
+def apply_spec(name, df):
+    """Run a spec's compiled steps over a DataFrame read from its input."""
+    for op, apply in compile_spec(name):
+        df = apply(df)
+        logger.info(f"{name} after {op}: {df.columns.tolist()}")
+    return df
+
+
+def run_embark_spec(name, s3_client, source_bucket, s3_key, assessment_id, target_bucket):
+    """Fingerprint, read, transform and write one embark class described by its spec."""
+    spec = get_spec(name)
+    label = spec['label']
+    version = transform_version(spec)
+    output_file_path = f"assessments/{assessment_id}/{spec['output']}.csv"
+    parquet_file_path = f"assessments/{assessment_id}/{spec['output']}.parquet"
+
+    # One listing of the assessment prefix answers the input and output lookups
+    index = S3PrefixIndex(s3_client, f'assessments/{assessment_id}/')
+
+    # Fingerprint the input file; a missing input is reported before any work is done
+    try:
+        fingerprint = input_fingerprint(s3_client, [(source_bucket, s3_key)], version, index)
+    except s3_client.exceptions.ClientError as e:
+        if e.response['Error']['Code'] == '404':
+            logger.error(f"Input file {s3_key} does not exist.")
+            return {
+                'statusCode': 404,
+                'body': f'Input file {s3_key} does not exist.'
+            }
+        else:
+            raise
+
+    # Skip only when the existing Embark CSV file was built from this exact input and spec
+    if is_output_current(s3_client, target_bucket, output_file_path, fingerprint, index):
+        logger.info(f"{label} file is up to date")
+        return {
+            'statusCode': 200,
+            'body': 'File already exists',
+            's3_file_path': f's3://{target_bucket}/{output_file_path}'
+        }
+    logger.info(f"{label} file does not exist or is stale, creating...")
+    metadata = fingerprint_metadata(fingerprint, version)
+
+    # Read data from S3 with the registered schema for this input
+    df = read_input_csv(s3_client, source_bucket, s3_key, usecols=input_columns(spec['read']))
+
+    df = apply_spec(name, df)
+
+    # Convert DataFrame to CSV and upload to S3
+    write_s3_csv(s3_client, df, target_bucket, output_file_path, metadata=metadata)
+    logger.info(f"{label} CSV file has been uploaded to S3.")
+
+    # Typed Parquet copy for the embark aggregator, which uses it only while it carries the CSV's fingerprint
+    write_s3_parquet(s3_client, df, target_bucket, parquet_file_path, metadata=metadata)
+
+    return {
+        'statusCode': 200,
+        'body': 'Processing complete',
+        's3_file_path': f's3://{target_bucket}/{output_file_path}'
+    }
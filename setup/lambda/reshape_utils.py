@@ -0,0 +1,78 @@
+import re
+import logging
+import numpy as np
+import pandas as pd
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def parse_wide_columns(columns, pattern):
+    """Split wide column names into (column, group, metric) using a two-group regex.
+
+    Each name is parsed once; columns that do not match are left out.
+    """
+    regex = re.compile(pattern)
+    parsed = []
+    for col in columns:
+        match = regex.match(col)
+        if match:
+            parsed.append((col, match.group(1), match.group(2)))
+    return parsed
+
+
+def wide_to_long(df, id_vars, pattern, group_name, metric_name):
+    """Reshape `<group>_<metric>` columns to one row per id and group, one column per metric.
+
+    Equivalent to melting the matched columns, extracting the group and metric from
+    each melted row and pivoting back on the metric, but the column names are parsed
+    once and the data is moved with a single stack. Rows are ordered by the id columns
+    and group and metric columns are sorted, as pivot does; missing combinations are NaN.
+    As with melt, every metric takes the common dtype of the matched columns, so whole
+    numbers next to float metrics are written as '472.0'.
+    """
+    parsed = parse_wide_columns(df.columns, pattern)
+    value_columns = [col for col, _, _ in parsed]
+
+    wide = df.set_index(id_vars)[value_columns]
+    common_dtype = pd.concat([wide[col].iloc[:0] for col in value_columns]).dtype if value_columns else None
+    if any(col_dtype != common_dtype for col_dtype in wide.dtypes):
+        wide = wide.astype(common_dtype)
+    wide.columns = pd.MultiIndex.from_tuples(
+        [(group, metric) for _, group, metric in parsed],
+        names=[group_name, metric_name]
+    )
+
+    long_df = wide.stack(level=group_name, future_stack=True)
+    long_df = long_df.sort_index().sort_index(axis=1)
+    if long_df.index.has_duplicates:
+        raise ValueError("Index contains duplicate entries, cannot reshape")
+    return long_df.reset_index()
+
+
+def lookup_values(keys, mapping, default=0):
+    """Vectorized dict lookup: map each key through `mapping`, using `default` when absent."""
+    return keys.astype(object).map(mapping).fillna(default).astype('float64')
+
+
+def decode_categories(values, decode):
+    """Apply a string transform to each distinct value of a low-cardinality column, not each row.
+
+    `values` is made categorical, `decode` is called once on its categories (a Series
+    of distinct strings) and may return a Series or a DataFrame, e.g.
+    `lambda s: s.str.extract(pattern)`. Each result column is mapped back to the rows
+    through the integer codes and returned as a categorical; missing values stay NaN.
+    """
+    categorical = values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype('category')
+    codes = categorical.cat.codes.to_numpy()
+    decoded = decode(pd.Series(categorical.cat.categories))
+
+    def broadcast(column):
+        column_codes, uniques = pd.factorize(column, sort=True)
+        row_codes = np.where(codes == -1, -1, column_codes[codes] if len(column_codes) else codes)
+        return pd.Categorical.from_codes(row_codes, categories=uniques)
+
+    if isinstance(decoded, pd.DataFrame):
+        return pd.DataFrame({name: broadcast(decoded[name]) for name in decoded.columns}, index=values.index)
+    return pd.Series(broadcast(decoded), index=values.index, name=values.name)
@@ -1,4 +1,3 @@
-import boto3
 import os
 import json
 import urllib.parse
@@ -6,27 +5,23 @@ import logging
 import zipfile
 import io
 from datetime import datetime
+from aws_clients import lazy_client, lazy_assumed_role_client
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-s3_client = boto3.client('s3')
+s3_client = lazy_client('s3')
 
-sts_client = boto3.client('sts')
-sts_response = sts_client.assume_role(
-    RoleArn='arn:aws:iam::548995328310:role/dynamoDB-cross-account',
-    RoleSessionName='cross-account-access-session',
-    DurationSeconds=900)
+# Clients in the QuickSight account; the role is assumed on first use and the
+# credentials are refreshed shortly before they expire
+cross_account_role_arn = 'arn:aws:iam::548995328310:role/dynamoDB-cross-account'
+cross_account_session_name = 'cross-account-access-session'
 
-quicksight_dynamodb_client = boto3.client('dynamodb', region_name='us-east-1',
-    aws_access_key_id=sts_response['Credentials']['AccessKeyId'],
-    aws_secret_access_key=sts_response['Credentials']['SecretAccessKey'],
-    aws_session_token=sts_response['Credentials']['SessionToken'])
-    
-quicksight_step_client = boto3.client('stepfunctions', region_name='us-east-1',
-    aws_access_key_id=sts_response['Credentials']['AccessKeyId'],
-    aws_secret_access_key=sts_response['Credentials']['SecretAccessKey'],
-    aws_session_token=sts_response['Credentials']['SessionToken'])
+quicksight_dynamodb_client = lazy_assumed_role_client('dynamodb', cross_account_role_arn, cross_account_session_name,
+    duration_seconds=900, region_name='us-east-1')
+
+quicksight_step_client = lazy_assumed_role_client('stepfunctions', cross_account_role_arn, cross_account_session_name,
+    duration_seconds=900, region_name='us-east-1')
 
 
 # Environment variables
@@ -36,10 +31,18 @@ step_arn = os.environ.get('STEP_FUNCTION_ARN', 'arn:aws:states:us-east-1:5489953
 region = os.environ.get('AWS_REGION', 'us-east-1')
 
 
+# Manifests written next to a partitioned output, listing its CSV parts
+PARTS_MANIFEST_SUFFIX = '.manifest.json'
+
+
 # Helper functions
 def construct_file_metadata(object_key):
     file_name = object_key.split("/")[-1]
-    file_name_without_ext = file_name.rsplit('.', 1)[0]
+    if file_name.endswith(PARTS_MANIFEST_SUFFIX):
+        # aggregated_embark.manifest.json publishes the same dataset as aggregated_embark.csv
+        file_name_without_ext = file_name[:-len(PARTS_MANIFEST_SUFFIX)]
+    else:
+        file_name_without_ext = file_name.rsplit('.', 1)[0]
     file_id = file_name_without_ext.replace('_', '-')
     return file_id, file_name, file_name_without_ext
 
@@ -84,14 +87,22 @@ def extract_zip_file_and_upload(s3_client, source_bucket, object_key, assessment
     return extracted_files
   
 
-def create_manifest(source_bucket, object_key, manifest_bucket, manifest_key):
+def read_part_keys(source_bucket, object_key):
+    """Return the object keys listed by a parts manifest, in manifest order."""
+    response = s3_client.get_object(Bucket=source_bucket, Key=object_key)
+    entries = json.loads(response['Body'].read())['entries']
+    prefix = f"s3://{source_bucket}/"
+    return [entry['url'][len(prefix):] for entry in entries if entry['url'].startswith(prefix)]
+
+
+def create_manifest(source_bucket, object_keys, manifest_bucket, manifest_key):
     try:
-        # Create the manifest
+        # Create the manifest, one entry per CSV of the dataset
         manifest_json = {
             "entries": [{
                 "url": f"s3://{source_bucket}/{object_key}",
                 "mandatory": True
-            }]
+            } for object_key in object_keys]
         }
         manifest_content = json.dumps(manifest_json, indent=4)
         s3_client.put_object(Bucket=manifest_bucket, Key=manifest_key, Body=manifest_content)
@@ -145,9 +156,17 @@ def lambda_handler(event, context):
                 logger.info("Zip File Processing complete. Exiting..")
                 continue
 
+            elif object_key.endswith(PARTS_MANIFEST_SUFFIX):
+                part_keys = read_part_keys(source_bucket, object_key)
+                manifest_key = f"{assessment_id}/manifest_{file_name_without_ext}.json"
+                create_manifest(source_bucket, part_keys, manifest_bucket, manifest_key)
+                update_file_received_status(quicksight_dynamodb_client, dynamodb_table, assessment_id, dataset_id)
+                logger.info(f"Parts manifest {file_name} - {len(part_keys)} parts listed in {manifest_key}")
+                continue
+
             elif object_key.lower().endswith('.csv'):
                 manifest_key = f"{assessment_id}/manifest_{file_name_without_ext}.json"
-                create_manifest(source_bucket, object_key, manifest_bucket, manifest_key)
+                create_manifest(source_bucket, [object_key], manifest_bucket, manifest_key)
                 update_file_received_status(quicksight_dynamodb_client, dynamodb_table, assessment_id, dataset_id)
 
                 if file_name in EMBARK_JOIN_KEYS:
@@ -0,0 +1,568 @@
+import os
+import logging
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# S3 rejects multipart parts smaller than 5 MiB (except the last one)
+MIN_PART_SIZE = 8 * 1024 * 1024
+
+# User metadata key recording which inputs an output was built from
+FINGERPRINT_METADATA_KEY = 'input-fingerprint'
+
+# Opt-in Arrow-backed frames: DTYPE_BACKEND=pyarrow (images with pyarrow only) reads strings and
+# numbers into Arrow memory; outputs are converted back so the CSVs match the NumPy path
+dtype_backend = os.getenv('DTYPE_BACKEND', 'numpy')
+
+
+class S3PrefixIndex:
+    """Existence, ETag and size lookups answered from one paginated listing of a prefix.
+
+    Each bucket is listed under `prefix` the first time it is queried; keys outside
+    the prefix fall back to head_object. With a `delimiter`, only keys directly under
+    the prefix are listed and deeper keys fall back to head_object too. The index is
+    a snapshot, so build one per invocation rather than caching it across warm starts.
+    """
+
+    def __init__(self, s3_client, prefix, delimiter=None):
+        self.s3_client = s3_client
+        self.prefix = prefix
+        self.delimiter = delimiter
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def _list_bucket(self, bucket_name):
+        with self._lock:
+            if bucket_name not in self._objects:
+                objects = {}
+                kwargs = {'Bucket': bucket_name, 'Prefix': self.prefix}
+                if self.delimiter:
+                    kwargs['Delimiter'] = self.delimiter
+                paginator = self.s3_client.get_paginator('list_objects_v2')
+                for page in paginator.paginate(**kwargs):
+                    for obj in page.get('Contents', []):
+                        objects[obj['Key']] = (obj['ETag'], obj['Size'])
+                logger.info(f"Indexed {len(objects)} objects under s3://{bucket_name}/{self.prefix}")
+                self._objects[bucket_name] = objects
+            return self._objects[bucket_name]
+
+    def _is_listed(self, object_key):
+        if not object_key.startswith(self.prefix):
+            return False
+        return not self.delimiter or self.delimiter not in object_key[len(self.prefix):]
+
+    def _lookup(self, bucket_name, object_key):
+        """Return (ETag, size) for an object, or None when it does not exist."""
+        if self._is_listed(object_key):
+            return self._list_bucket(bucket_name).get(object_key)
+        try:
+            response = self.s3_client.head_object(Bucket=bucket_name, Key=object_key)
+        except self.s3_client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == '404':
+                return None
+            raise
+        return response['ETag'], response['ContentLength']
+
+    def etag(self, bucket_name, object_key):
+        """Return the ETag of an object, or None when it does not exist."""
+        entry = self._lookup(bucket_name, object_key)
+        return entry[0] if entry else None
+
+    def size(self, bucket_name, object_key):
+        """Return the size in bytes of an object, or None when it does not exist."""
+        entry = self._lookup(bucket_name, object_key)
+        return entry[1] if entry else None
+
+    def exists(self, bucket_name, object_key):
+        """Return True when the object exists."""
+        return self._lookup(bucket_name, object_key) is not None
+
+    def keys(self, bucket_name):
+        """Return the listed keys of a bucket in key order."""
+        return sorted(self._list_bucket(bucket_name))
+
+
+def input_fingerprint(s3_client, inputs, transform_version, index=None):
+    """Fingerprint a transform's inputs from their ETags and the transform version.
+
+    `inputs` is a list of (bucket, key) pairs. ETags come from `index` when one is
+    given, otherwise from concurrent head_object calls. A missing input raises a 404
+    ClientError, so callers can report it the same way as before.
+    """
+    def head_etag(bucket_name, object_key):
+        if index is None:
+            return s3_client.head_object(Bucket=bucket_name, Key=object_key)['ETag']
+        etag = index.etag(bucket_name, object_key)
+        if etag is None:
+            raise s3_client.exceptions.ClientError(
+                {'Error': {'Code': '404', 'Message': f'Not Found: {bucket_name}/{object_key}'}}, 'HeadObject'
+            )
+        return etag
+
+    # The lookups are independent, so they are issued concurrently
+    with ThreadPoolExecutor(max_workers=max(len(inputs), 1)) as executor:
+        etags = list(executor.map(head_etag, *zip(*inputs))) if inputs else []
+
+    entries = [transform_version]
+    entries += [f'{bucket_name}/{object_key}={etag}' for (bucket_name, object_key), etag in zip(inputs, etags)]
+    return hashlib.sha256('|'.join(entries).encode('utf-8')).hexdigest()
+
+
+def fingerprint_metadata(fingerprint, transform_version):
+    """User metadata stored on an output so later runs can tell whether it is stale."""
+    return {FINGERPRINT_METADATA_KEY: fingerprint, 'transform-version': transform_version}
+
+
+def is_output_current(s3_client, bucket_name, object_key, fingerprint, index=None):
+    """Return True when the output exists and was built from inputs with this fingerprint.
+
+    With an `index`, a missing output is detected without a request; the metadata of
+    an existing one still needs a head_object.
+    """
+    if index is not None and not index.exists(bucket_name, object_key):
+        return False
+    try:
+        response = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    except s3_client.exceptions.ClientError as e:
+        if e.response['Error']['Code'] == '404':
+            return False
+        raise
+    return response.get('Metadata', {}).get(FINGERPRINT_METADATA_KEY) == fingerprint
+
+
+def use_arrow():
+    """Return True when frames are read with the Arrow dtype backend."""
+    return dtype_backend == 'pyarrow'
+
+
+def backend_options():
+    """Keyword arguments selecting the configured dtype backend in pandas readers."""
+    return {'dtype_backend': 'pyarrow'} if use_arrow() else {}
+
+
+def arrow_dtype(dtype):
+    """Arrow-backed equivalent of a read_csv dtype; categoricals stay pandas dictionaries."""
+    import pyarrow as pa
+
+    if dtype in ('category', None) or isinstance(dtype, (pd.CategoricalDtype, pd.ArrowDtype)):
+        return dtype
+    if dtype in ('str', str, 'object', object):
+        return pd.ArrowDtype(pa.string())
+    # Nullable pandas integers ('Int64') map to their NumPy width; Arrow columns hold nulls anyway
+    numpy_dtype = getattr(pd.api.types.pandas_dtype(dtype), 'numpy_dtype', dtype)
+    return pd.ArrowDtype(pa.from_numpy_dtype(np.dtype(numpy_dtype)))
+
+
+def arrow_dtypes(dtype):
+    """Map a read_csv `dtype` argument (a single dtype or a column mapping) to the Arrow backend."""
+    if isinstance(dtype, dict):
+        return {col: arrow_dtype(col_dtype) for col, col_dtype in dtype.items()}
+    return arrow_dtype(dtype)
+
+
+def numpy_column(series):
+    """Convert an Arrow-backed column to the dtype the NumPy path would have parsed.
+
+    Integers with nulls become float64 and strings and booleans with nulls become object
+    columns holding NaN, as read_csv produces without a dtype backend.
+    """
+    import pyarrow as pa
+
+    arrow_type = series.dtype.pyarrow_dtype
+    has_nulls = series.hasnans
+    if pa.types.is_dictionary(arrow_type):
+        return series.astype(object).astype('category')
+    if pa.types.is_floating(arrow_type) or (pa.types.is_integer(arrow_type) and has_nulls):
+        return pd.Series(series.to_numpy(dtype='float64', na_value=np.nan), index=series.index, name=series.name)
+    if (pa.types.is_integer(arrow_type) or pa.types.is_boolean(arrow_type)) and not has_nulls:
+        return pd.Series(series.to_numpy(dtype=arrow_type.to_pandas_dtype()), index=series.index, name=series.name)
+    if pa.types.is_timestamp(arrow_type):
+        return series.astype(f'datetime64[{arrow_type.unit}]')
+    return pd.Series(series.to_numpy(dtype=object, na_value=np.nan), index=series.index, name=series.name)
+
+
+def numpy_frame(df):
+    """Return `df` with its Arrow-backed columns converted by numpy_column; NumPy frames are returned as is."""
+    arrow_columns = [col for col, col_dtype in df.dtypes.items() if isinstance(col_dtype, pd.ArrowDtype)]
+    if not arrow_columns:
+        return df
+    df = df.copy(deep=False)
+    for col in arrow_columns:
+        df[col] = numpy_column(df[col])
+    return df
+
+
+def arrow_types_mapper():
+    """types_mapper for Table.to_pandas under the configured backend; dictionaries stay categoricals."""
+    if not use_arrow():
+        return None
+    import pyarrow as pa
+
+    return lambda arrow_type: None if pa.types.is_dictionary(arrow_type) else pd.ArrowDtype(arrow_type)
+
+
+def read_s3_csv(s3_client, bucket_name, object_key, dtype=None, usecols=None, chunksize=None):
+    """Utility function to read CSV from S3.
+
+    The StreamingBody is passed straight to the parser, so the object is never held
+    in memory as raw bytes and again as a decoded string. With `chunksize` set, an
+    iterator of DataFrames is returned instead of a single DataFrame. With the Arrow
+    backend, `dtype` is mapped by arrow_dtypes and the other columns are inferred as Arrow types.
+    """
+    obj = s3_client.get_object(Bucket=bucket_name, Key=object_key)
+    if use_arrow():
+        dtype = arrow_dtypes(dtype)
+    return pd.read_csv(obj['Body'], dtype=dtype, usecols=usecols, chunksize=chunksize, **backend_options())
+
+
+def iter_s3_csv(s3_client, bucket_name, object_key, chunksize=100000, dtype=None, usecols=None):
+    """Yield DataFrames of at most `chunksize` rows streamed from a CSV in S3."""
+    with read_s3_csv(s3_client, bucket_name, object_key, dtype=dtype, usecols=usecols, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def read_s3_parquet(s3_client, bucket_name, object_key, columns=None):
+    """Utility function to read Parquet from S3.
+
+    When `columns` is given, only those present in the file are decoded.
+    """
+    # pyarrow is only installed in the images that read or write Parquet
+    import pyarrow.parquet as pq
+
+    obj = s3_client.get_object(Bucket=bucket_name, Key=object_key)
+    parquet_file = pq.ParquetFile(BytesIO(obj['Body'].read()))
+    if columns is not None:
+        columns = [col for col in columns if col in parquet_file.schema_arrow.names]
+    return parquet_file.read(columns=columns).to_pandas(types_mapper=arrow_types_mapper())
+
+
+def write_s3_parquet(s3_client, df, bucket_name, object_key, metadata=None):
+    """Utility function to write a DataFrame to S3 as Parquet.
+
+    Returns False when the frame cannot be encoded (e.g. an object column with mixed
+    types); any older copy is removed so readers fall back to the CSV.
+    """
+    buffer = BytesIO()
+    try:
+        df.to_parquet(buffer, index=False)
+    except (TypeError, ValueError) as e:
+        logger.error(f"Skipping Parquet copy {object_key}: {e}")
+        s3_client.delete_object(Bucket=bucket_name, Key=object_key)
+        return False
+    buffer.seek(0)
+    s3_client.put_object(Bucket=bucket_name, Key=object_key, Body=buffer, Metadata=metadata or {})
+    return True
+
+
+def upload_part(s3_client, bucket_name, object_key, upload_id, part_number, body):
+    """Upload a single part of a multipart upload and return its completion entry."""
+    response = s3_client.upload_part(
+        Bucket=bucket_name,
+        Key=object_key,
+        UploadId=upload_id,
+        PartNumber=part_number,
+        Body=body
+    )
+    return {'ETag': response['ETag'], 'PartNumber': part_number}
+
+
+class S3CsvUpload:
+    """CSV object written to S3 one DataFrame at a time.
+
+    The header is written with the first frame. Encoded rows are buffered until a part
+    of at least `part_size` is ready, and parts are uploaded as a multipart upload with
+    up to `max_workers` in flight, so memory is bounded by the part size rather than by
+    the size of the output. The object only appears when close() completes the upload;
+    output that fits in a single part is written with one put_object call. `metadata` is
+    stored as S3 user metadata on the object. Used as a context manager, the upload is
+    aborted if the block raises.
+    """
+
+    def __init__(self, s3_client, bucket_name, object_key, part_size=MIN_PART_SIZE, max_workers=4, metadata=None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.part_size = part_size
+        self.max_workers = max_workers
+        self.metadata = metadata or {}
+        self._buffer = bytearray()
+        self._header = True
+        # The first part is held back until a second one shows a multipart upload is needed
+        self._first_part = None
+        self._upload_id = None
+        self._executor = None
+        self._futures = []
+
+    def write(self, df):
+        """Append the rows of `df`."""
+        self._buffer += numpy_frame(df).to_csv(index=False, header=self._header).encode('utf-8')
+        self._header = False
+        if len(self._buffer) >= self.part_size:
+            self._add_part(bytes(self._buffer))
+            self._buffer = bytearray()
+
+    def _add_part(self, body):
+        if self._upload_id is None:
+            if self._first_part is None:
+                self._first_part = body
+                return
+            self._upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket_name, Key=self.object_key, Metadata=self.metadata
+            )['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self._submit(self._first_part)
+            self._first_part = None
+        self._submit(body)
+
+    def _submit(self, body):
+        # Hold back encoding until a worker is free so only `max_workers` parts are buffered
+        in_flight = [future for future in self._futures if not future.done()]
+        if len(in_flight) >= self.max_workers:
+            wait(in_flight, return_when=FIRST_COMPLETED)
+        part_number = len(self._futures) + 1
+        self._futures.append(self._executor.submit(
+            upload_part, self.s3_client, self.bucket_name, self.object_key, self._upload_id, part_number, body
+        ))
+
+    def close(self):
+        """Upload the remaining rows and make the object visible."""
+        if self._buffer:
+            self._add_part(bytes(self._buffer))
+            self._buffer = bytearray()
+
+        if self._upload_id is None:
+            self.s3_client.put_object(
+                Bucket=self.bucket_name, Key=self.object_key, Body=self._first_part or b'', Metadata=self.metadata
+            )
+            return
+
+        try:
+            completed_parts = [future.result() for future in self._futures]
+        finally:
+            self._executor.shutdown()
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=self.object_key,
+            UploadId=self._upload_id,
+            MultipartUpload={'Parts': completed_parts}
+        )
+        logger.info(f"Uploaded {self.object_key} in {len(completed_parts)} parts.")
+
+    def abort(self):
+        """Discard the upload; nothing is written."""
+        if self._upload_id is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.object_key, UploadId=self._upload_id)
+            self._upload_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+            return False
+        try:
+            self.close()
+        except Exception:
+            self.abort()
+            raise
+        return False
+
+
+def write_s3_csv(s3_client, df, bucket_name, object_key, chunk_rows=50000, part_size=MIN_PART_SIZE, max_workers=4,
+                 metadata=None):
+    """Utility function to write a DataFrame to S3 as CSV.
+
+    Rows are encoded `chunk_rows` at a time and streamed through S3CsvUpload, so peak
+    memory is bounded by the part size and the number of parts in flight rather than
+    by the size of the output. `metadata` is stored as S3 user metadata on the object.
+    """
+    with S3CsvUpload(s3_client, bucket_name, object_key, part_size, max_workers, metadata) as upload:
+        for start in range(0, max(len(df), 1), chunk_rows):
+            upload.write(df.iloc[start:start + chunk_rows])
+
+
+class S3ParquetUpload:
+    """Parquet object written one DataFrame at a time.
+
+    Each frame becomes a row group in a local file (under /tmp by default) that is
+    uploaded by close(), so only one frame is held in memory. If a frame cannot be
+    encoded with the schema of the first one, or no rows were written, the Parquet copy
+    is skipped and any older copy removed, as write_s3_parquet does. Used as a context
+    manager, nothing is uploaded if the block raises.
+    """
+
+    def __init__(self, s3_client, bucket_name, object_key, metadata=None, local_dir=None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.metadata = metadata or {}
+        fd, self.path = tempfile.mkstemp(suffix='.parquet', dir=local_dir)
+        os.close(fd)
+        self._writer = None
+        self._failed = False
+
+    def write(self, df):
+        """Append the rows of `df` as a row group."""
+        # pyarrow is only installed in the images that read or write Parquet
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._failed or df.empty:
+            return
+        try:
+            schema = self._writer.schema if self._writer is not None else None
+            table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Skipping Parquet copy {self.object_key}: {e}")
+            self._failed = True
+
+    def close(self):
+        """Upload the file; returns False when the Parquet copy was skipped."""
+        try:
+            if self._writer is not None:
+                self._writer.close()
+            if self._failed or self._writer is None:
+                self.s3_client.delete_object(Bucket=self.bucket_name, Key=self.object_key)
+                return False
+            with open(self.path, 'rb') as f:
+                self.s3_client.put_object(Bucket=self.bucket_name, Key=self.object_key, Body=f, Metadata=self.metadata)
+            return True
+        finally:
+            os.remove(self.path)
+
+    def abort(self):
+        """Discard the local file without touching S3."""
+        if self._writer is not None:
+            self._writer.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
+
+
+class PrefetchingS3Client:
+    """S3 client wrapper that downloads objects ahead of the get_object call that needs them.
+
+    prefetch() starts a background get_object and reads the body into memory when it is
+    no larger than `max_prefetch_bytes`; larger objects keep their streaming body. The
+    next get_object for that key (without extra arguments) returns the prefetched
+    response, or raises its error. Every other call goes straight to the wrapped client.
+
+    Prefetches nobody consumes are released by discard() or close() (also on leaving a
+    `with` block): pending downloads are cancelled and unread streaming bodies closed,
+    so their connections go back to the pool.
+    """
+
+    def __init__(self, s3_client, executor, max_prefetch_bytes):
+        self._s3_client = s3_client
+        self._executor = executor
+        self._max_prefetch_bytes = max_prefetch_bytes
+        self._pending = {}
+
+    def _fetch(self, bucket_name, object_key):
+        response = self._s3_client.get_object(Bucket=bucket_name, Key=object_key)
+        if response.get('ContentLength', 0) <= self._max_prefetch_bytes:
+            response['Body'] = BytesIO(response['Body'].read())
+        return response
+
+    def prefetch(self, bucket_name, object_key):
+        key = (bucket_name, object_key)
+        if key not in self._pending:
+            self._pending[key] = self._executor.submit(self._fetch, bucket_name, object_key)
+
+    def get_object(self, Bucket, Key, **kwargs):
+        future = self._pending.pop((Bucket, Key), None)
+        if future is not None and not kwargs:
+            return future.result()
+        if future is not None:
+            self._release(future)
+        return self._s3_client.get_object(Bucket=Bucket, Key=Key, **kwargs)
+
+    @staticmethod
+    def _release(future):
+        if future.cancel():
+            return
+        try:
+            future.result()['Body'].close()
+        except Exception:
+            pass
+
+    def discard(self, bucket_name, object_key):
+        """Release the prefetch of one object if get_object never consumed it."""
+        future = self._pending.pop((bucket_name, object_key), None)
+        if future is not None:
+            self._release(future)
+
+    def close(self):
+        """Release every prefetch that was not consumed."""
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            self._release(future)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._s3_client, name)
+
+
+def process_batch(s3_client, items, process, source_bucket, max_prefetch_bytes=256 * 1024 * 1024):
+    """Run `process(client, item)` for each batch item in this warm process.
+
+    Items carry the 's3_key' of their input. While one item is transformed, the next
+    item's input is downloaded in the background through a PrefetchingS3Client, so
+    S3 reads overlap compute. A failing item is reported in its result and the batch
+    moves on. An item whose output is already current never reads its input, so its
+    prefetch is discarded once the item is done; whatever is still pending when the batch
+    ends is released with the client.
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=1) as executor, \
+            PrefetchingS3Client(s3_client, executor, max_prefetch_bytes) as client:
+        for position, item in enumerate(items):
+            if position == 0:
+                client.prefetch(source_bucket, item['s3_key'])
+            if position + 1 < len(items):
+                client.prefetch(source_bucket, items[position + 1]['s3_key'])
+
+            logger.info(f"Batch item {position + 1}/{len(items)}: assessment {item.get('assessment_id')}")
+            try:
+                result = process(client, item)
+            except Exception as e:
+                logger.error(f"Error processing assessment {item.get('assessment_id')}: {str(e)}")
+                result = {'statusCode': 500, 'body': f"Error processing {item.get('s3_key')}: {str(e)}"}
+            finally:
+                client.discard(source_bucket, item['s3_key'])
+            results.append({'assessment_id': item.get('assessment_id'), 's3_key': item.get('s3_key'), **result})
+
+    failed = sum(1 for result in results if result['statusCode'] >= 400)
+    return {
+        'statusCode': 200 if failed == 0 else 207,
+        'body': f'Processed {len(results)} assessments, {failed} failed',
+        'results': results
+    }
@@ -0,0 +1,245 @@
+import os
+import re
+import json
+import logging
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from s3_utils import read_s3_csv
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# QuickSight table maps copied into the image
+table_maps_path = os.getenv('TABLE_MAPS_PATH', '/var/task/table_maps/')
+
+# QuickSight column types -> pandas dtypes passed to read_csv. The embark CSVs are written
+# from the parsed values, so STRING and DECIMAL stay with read_csv's inference: str would keep
+# NIIN leading zeros the published files drop and float64 would write whole numbers as '23.0'.
+# INTEGER is parsed as nullable Int64 rather than int32 because the C parser wraps values
+# outside a 32-bit range silently (assessment ids do not fit); settle_integers narrows after.
+QUICKSIGHT_DTYPES = {
+    'STRING': None,
+    'DECIMAL': None,
+    'INTEGER': 'Int64',
+    'DATETIME': None
+}
+
+# Per-input low-cardinality dimension columns parsed as categoricals
+CATEGORICAL_COLUMNS = {
+    'RD_I_POS_Pallet_Requirement': [
+        'Class_of_Supply', 'Ration_Type', 'Region', 'Region_MEF_Lead', 'Location_Name',
+        'Unit of Issue', 'CAP_Name', 'CAP_Names'
+    ],
+    'RD_IW_PaxLocationAll_joined': [
+        'Class_of_Supply', 'Region', 'Region_MEF_Lead', 'MEF', 'MSE', 'Service', 'Location_Name',
+        'POS', 'DOS', 'DOS_Period', 'CAP_Name', 'CAP_Names'
+    ],
+    'RD_II_VII_DailyTE_WithDimensions': [
+        'Class_of_Supply', 'Region', 'Region_MEF_Lead', 'MEF', 'MSE', 'Location_Name', 'POS',
+        'TAMCN_Group', 'CAP_Name', 'CAP_Names'
+    ],
+    'RD_IIIP_POL_Pkg_NSN_Requirements_PBI': [
+        'Class_of_Supply', 'REGION', 'MEF', 'LOCATION_NAME', 'POS', 'POL_Type', 'POL_Pkg_Type'
+    ],
+    'RD_IV_Daily_Requirements': [
+        'Class_of_Supply', 'Region', 'Region_MEF_Lead', 'MEF_Lead', 'Location_Name', 'POS', 'UI', 'UOM'
+    ],
+    'RD_VI_POS_Pallet_Requirement': [
+        'Class_of_Supply', 'HCP_Type', 'Region', 'Region_MEF_Lead', 'Location_Name',
+        'Unit of Issue', 'CAP_Name', 'CAP_Names'
+    ],
+    'RD_IX_Requirement': [
+        'Class_of_Supply', 'Region', 'REGION', 'MEF', 'FIE', 'Location Name', 'LOCATION_NAME',
+        'UNIT_OF_ISSUE'
+    ],
+    'classix_dimensional_data': ['UI']
+}
+
+# Per-input dtypes: the schemas these inputs were already parsed with
+SCHEMA_OVERRIDES = {
+    'RD_IX_Requirement': {
+        'AssessmentNumber': 'str',
+        'SECREP Flag': 'bool',
+        'Battery Flag': 'bool',
+        'TAMCN_NIIN': 'str',
+        'TAMCN_of_End_Item': 'str',
+        'NIIN_of_End_Item': 'str',
+        'COLLOQUIAL_NAME': 'str',
+        'TAMCN_NIIN_QTY_FIE': 'float64',
+        'TAMCN_NIIN_QTY_POS1': 'float64',
+        'TAMCN_NIIN_QTY_POS2': 'float64',
+        'TAMCN_NIIN_QTY_POS3': 'float64',
+        'TAMCN_NIIN_QTY_BEYOND': 'float64',
+        'FSC of Part Required': 'str',
+        'NIIN of Part Required': 'str',
+        'Nomenclature of Part Required': 'str',
+        'STANDARD UNIT PRICE': 'float64',
+        'Required_FIE': 'int64',
+        'Required_POS1': 'int64',
+        'Required_POS2': 'int64',
+        'Required_POS3': 'int64',
+        'Required_BEYOND': 'int64',
+        'Total_Required_Less_FIE': 'float64',
+        'Total_Required_Selected_Confidence': 'float64',
+        'Value_FIE': 'float64',
+        'Value_POS1': 'float64',
+        'Value_POS2': 'float64',
+        'Value_POS3': 'float64',
+        'Value_BEYOND': 'float64',
+        'Total_Value_Less_FIE': 'float64',
+        'Total_Value_Selected_Confidence': 'float64',
+        'IND STON': 'float64',
+        'IND SQFT': 'float64',
+        'DIM LENGTH INCHES': 'float64',
+        'DIM WIDTH INCHES': 'float64',
+        'DIM HEIGHT INCHES': 'float64'
+    },
+    'RD_VI_POS_Pallet_Requirement': {
+        'AssessmentNumber': 'str',
+        'DESCRIPTION': 'str',
+        'TAMCN': 'str',
+        'FSC': 'str',
+        'NIIN': 'str',
+        'NSN': 'str',
+        'TPFDD_TAMCN': 'str',
+        'TPFDD_NSN': 'str',
+        'Description': 'str',
+        'Location_ID': 'str',
+        'DOS1_Units': 'float64',
+        'DOS2_Units': 'float64',
+        'DOS3_Units': 'float64',
+        'DOS1_Units_NIIN_Qty': 'float64',
+        'DOS2_Units_NIIN_Qty': 'float64',
+        'DOS3_Units_NIIN_Qty': 'float64',
+        'DOS1_Units_NIIN_Qty_Pallet_Qty': 'float64',
+        'DOS2_Units_NIIN_Qty_Pallet_Qty': 'float64',
+        'DOS3_Units_NIIN_Qty_Pallet_Qty': 'float64',
+        'DOS1_Units_NIIN_Qty_Pallet_Tot_CuFT': 'float64',
+        'DOS2_Units_NIIN_Qty_Pallet_Tot_CuFT': 'float64',
+        'DOS3_Units_NIIN_Qty_Pallet_Tot_CuFT': 'float64',
+        'DOS1_Units_NIIN_Qty_Pallet_Tot_Wt(lbs)': 'float64',
+        'DOS2_Units_NIIN_Qty_Pallet_Tot_Wt(lbs)': 'float64',
+        'DOS3_Units_NIIN_Qty_Pallet_Tot_Wt(lbs)': 'float64',
+        'DOS1_Units_NIIN_Qty_Pallet_Tot_TEUs': 'float64',
+        'DOS2_Units_NIIN_Qty_Pallet_Tot_TEUs': 'float64',
+        'DOS3_Units_NIIN_Qty_Pallet_Tot_TEUs': 'float64',
+        'DOS1_Units_NIIN_Qty_Pallet_Tot_FEUs': 'float64',
+        'DOS2_Units_NIIN_Qty_Pallet_Tot_FEUs': 'float64',
+        'DOS3_Units_NIIN_Qty_Pallet_Tot_FEUs': 'float64'
+    },
+    'classix_dimensional_data': {
+        'FSC': 'str',
+        'NIIN': 'str'
+    }
+}
+
+
+def get_input_name(object_key):
+    """Return the table map name for an input key, e.g. RD_IV_Daily_Requirements."""
+    return object_key.split('/')[-1].rsplit('.', 1)[0]
+
+
+def raw_column_name(map_column_name):
+    """Translate a table map column name back to the raw CSV header.
+
+    The table maps were generated from R, which rewrites 'Wt(lbs)' as 'Wt.lbs.'
+    and spaces as dots.
+    """
+    name = re.sub(r'\.(\w+)\.$', r'(\1)', map_column_name)
+    return name.replace('.', ' ')
+
+
+@lru_cache(maxsize=None)
+def load_table_map_types(input_name):
+    """Read the QuickSight column types for an input from its logical and physical table maps."""
+    physical_map_path = os.path.join(table_maps_path, f'{input_name}_physical_map.json')
+    logical_map_path = os.path.join(table_maps_path, f'{input_name}_logical_map.json')
+    if not os.path.exists(physical_map_path):
+        logger.info(f"No table map for {input_name}, using overrides only")
+        return {}
+
+    with open(physical_map_path, 'r') as file:
+        physical_table = next(iter(json.load(file).values()))
+    column_types = {col['Name']: col['Type'] for col in physical_table['S3Source']['InputColumns']}
+
+    # The physical map reads every column as STRING; the real types are the logical map casts
+    if os.path.exists(logical_map_path):
+        with open(logical_map_path, 'r') as file:
+            logical_table = next(iter(json.load(file).values()))
+        for transform in logical_table.get('DataTransforms', []):
+            cast = transform.get('CastColumnTypeOperation')
+            if cast and cast['ColumnName'] in column_types:
+                column_types[cast['ColumnName']] = cast['NewColumnType']
+
+    return column_types
+
+
+def get_input_dtypes(input_name, integers=True):
+    """Build the pandas dtype mapping used to parse an input.
+
+    Table map types come first, then the input's categorical dimensions, then its
+    overrides. With `integers` False the INTEGER columns are left to inference.
+    """
+    dtypes = {}
+    for name, column_type in load_table_map_types(input_name).items():
+        dtype = QUICKSIGHT_DTYPES.get(column_type)
+        if dtype is not None and (integers or column_type != 'INTEGER'):
+            dtypes[name] = dtype
+            dtypes[raw_column_name(name)] = dtype
+
+    for name in CATEGORICAL_COLUMNS.get(input_name, []):
+        dtypes[name] = 'category'
+
+    dtypes.update(SCHEMA_OVERRIDES.get(input_name, {}))
+    return dtypes
+
+
+@lru_cache(maxsize=None)
+def get_integer_columns(input_name):
+    """Return the columns of an input that QuickSight treats as INTEGER."""
+    columns = set()
+    for name, column_type in load_table_map_types(input_name).items():
+        if column_type == 'INTEGER':
+            columns.update([name, raw_column_name(name)])
+    return frozenset(columns)
+
+
+def settle_integers(df, columns):
+    """Give the Int64-parsed INTEGER columns the dtype inference would have, then downcast them.
+
+    A column without blanks becomes int64 and one with blanks float64, as read_csv infers
+    them, so the CSVs written from them keep their formatting. Arrow-backed integers
+    already hold nulls the way inference does and are only downcast.
+    """
+    for col in columns:
+        if col in df.columns and isinstance(df[col].dtype, pd.Int64Dtype):
+            df[col] = df[col].astype('float64' if df[col].hasnans else 'int64')
+    return downcast_integers(df, columns)
+
+
+def read_input_csv(s3_client, bucket_name, object_key, usecols=None):
+    """Read an input CSV from S3 with its registered dtypes and settle its INTEGER columns.
+
+    When a column the table map calls INTEGER holds fractions, the Int64 parse fails and
+    the input is read again with its INTEGER columns inferred.
+    """
+    input_name = get_input_name(object_key)
+    try:
+        df = read_s3_csv(s3_client, bucket_name, object_key, dtype=get_input_dtypes(input_name), usecols=usecols)
+    except (TypeError, ValueError) as e:
+        logger.warning(f"{object_key} does not match the INTEGER columns of its table map ({e}); reading them with inferred types")
+        df = read_s3_csv(s3_client, bucket_name, object_key, dtype=get_input_dtypes(input_name, integers=False), usecols=usecols)
+    return settle_integers(df, get_integer_columns(input_name))
+
+
+def downcast_integers(df, columns):
+    """Downcast int64 columns (NumPy or Arrow-backed) to int32 where every value fits."""
+    int32 = np.iinfo(np.int32)
+    downcasts = {'int64': 'int32', 'int64[pyarrow]': 'int32[pyarrow]'}
+    for col in columns:
+        if col in df.columns and str(df[col].dtype) in downcasts and df[col].between(int32.min, int32.max).all():
+            df[col] = df[col].astype(downcasts[str(df[col].dtype)])
+    return df
+
@@ -1,4 +1,4 @@
-import boto3
+from aws_clients import lazy_client
 import os
 import logging
 import json
@@ -15,9 +15,9 @@ logger.setLevel(logging.DEBUG)  # Set to DEBUG to capture all log levels
 
 
 # Initialize AWS clients outside the Lambda handler for reuse
-s3_client = boto3.client('s3')
-quicksight_client = boto3.client('quicksight')
-dynamodb_client = boto3.client('dynamodb')
+s3_client = lazy_client('s3')
+quicksight_client = lazy_client('quicksight')
+dynamodb_client = lazy_client('dynamodb')
 
 
 # Local files
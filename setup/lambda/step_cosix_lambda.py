@@ -1,60 +1,64 @@
 import pandas as pd
-import boto3
 import numpy as np
-from io import StringIO
 import logging
 import json
-import shutil
+import os
+from schema_registry import get_input_name, get_input_dtypes
+from classix_lookup import load_classix_lookup
+from reshape_utils import decode_categories
+from s3_utils import read_s3_csv, iter_s3_csv, write_s3_csv, write_s3_parquet, S3CsvUpload, S3ParquetUpload, input_fingerprint, is_output_current, fingerprint_metadata, S3PrefixIndex
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-s3_client = boto3.client('s3')
-dynamodb_client = boto3.client('dynamodb')
-
-
-def read_s3_csv(s3_client, bucket_name, object_key, dtype=None, usecols=None):
-    """Utility function to read CSV from S3."""
-    obj = s3_client.get_object(Bucket=bucket_name, Key=object_key)
-    return pd.read_csv(StringIO(obj['Body'].read().decode('utf-8')), dtype=dtype, usecols=usecols)
-
-
-def check_file_exists(s3_client, bucket, key):
-    """Check if a file exists in S3 with retry logic."""
-    s3_client.head_object(Bucket=bucket, Key=key)
+# Bump when the transform logic changes so existing outputs are rebuilt
+TRANSFORM_VERSION = '2'
+
+# Input columns the transform reads
+INPUT_COLUMNS = [
+    "AssessmentNumber", "Class_of_Supply", "Region", "MEF", "FIE", "Location Name",
+    'SECREP Flag', 'Battery Flag',
+    "TAMCN_NIIN", "TAMCN_of_End_Item", "NIIN_of_End_Item", "COLLOQUIAL_NAME",
+    "TAMCN_NIIN_QTY_FIE", "TAMCN_NIIN_QTY_POS1", "TAMCN_NIIN_QTY_POS2", "TAMCN_NIIN_QTY_POS3",
+    "TAMCN_NIIN_QTY_BEYOND", "FSC of Part Required", "NIIN of Part Required",
+    "Nomenclature of Part Required", "UNIT_OF_ISSUE",
+    "STANDARD UNIT PRICE", "Required_FIE", "Required_POS1", "Required_POS2", "Required_POS3",
+    "Required_BEYOND", "Total_Required_Less_FIE", "Total_Required_Selected_Confidence",
+    "Value_FIE", "Value_POS1", "Value_POS2", "Value_POS3", "Value_BEYOND",
+    "Total_Value_Less_FIE", "Total_Value_Selected_Confidence", "IND STON", "IND SQFT",
+    "DIM LENGTH INCHES", "DIM WIDTH INCHES", "DIM HEIGHT INCHES"
+]
+
+# Inputs larger than this are streamed in row chunks so memory stays flat. Both paths
+# transform blocks of chunk_rows input rows, so the output order is the same either way:
+# block by block, and within a block by POS column, then input row
+stream_threshold_bytes = int(os.getenv('COSIX_STREAM_THRESHOLD_MB', '256')) * 1024 * 1024
+chunk_rows = int(os.getenv('COSIX_CHUNK_ROWS', '100000'))
+
+
+def stream_dtypes(dtypes):
+    """Return the fixed dtype of every input column for a streamed read.
+
+    Each chunk is parsed on its own, so nothing may be inferred per chunk: a column
+    without a registered dtype raises KeyError here. Categoricals are read as str, since
+    their categories (and the Parquet dictionary width) would otherwise follow the chunk.
+    """
+    return {col: 'str' if dtypes[col] == 'category' else dtypes[col] for col in INPUT_COLUMNS}
 
 
 def cosix_embark(s3_client, source_bucket, s3_key, assessment_id, target_bucket):
-    # Local files
-    source_path = '/var/task/classix_dimensional_data.csv'
-    destination_path = '/tmp/classix_dimensional_data.csv'
-
-    # Copy dimensional data lookup file to /tmp directory
-    shutil.copyfile(source_path, destination_path)
-
     # Define file paths
     input_file_path = s3_key
     output_file_path = f'assessments/{assessment_id}/cosix_embark.csv'
+    parquet_file_path = f'assessments/{assessment_id}/cosix_embark.parquet'
 
-    # Check for the existence of the COSIX Embark CSV file
-    try:
-        s3_client.head_object(Bucket=target_bucket, Key=output_file_path)
-        logger.info("Class IX Embark file already exists")
-        return {
-            'statusCode': 200,
-            'body': 'File already exists',
-            's3_file_path': f's3://{target_bucket}/{output_file_path}'
-        }
-    except s3_client.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            logger.info("Class IX Embark file does not exist, creating...")
-        else:
-            raise
+    # One listing of the assessment prefix answers the input and output lookups
+    index = S3PrefixIndex(s3_client, f'assessments/{assessment_id}/')
 
-    # Check for the input file to be available with retry logic
+    # Fingerprint the input file; a missing input is reported before any work is done
     try:
-        check_file_exists(s3_client, source_bucket, input_file_path)
+        fingerprint = input_fingerprint(s3_client, [(source_bucket, input_file_path)], TRANSFORM_VERSION, index)
     except s3_client.exceptions.ClientError as e:
         if e.response['Error']['Code'] == '404':
             logger.error(f"Input file {input_file_path} does not exist.")
@@ -65,64 +69,77 @@ def cosix_embark(s3_client, source_bucket, s3_key, assessment_id, target_bucket)
         else:
             raise
 
-    # Read data from S3
-    columns_to_keep = [
-        "AssessmentNumber", "Class_of_Supply", "Region", "MEF", "FIE", "Location Name",
-        'SECREP Flag', 'Battery Flag',
-        "TAMCN_NIIN", "TAMCN_of_End_Item", "NIIN_of_End_Item", "COLLOQUIAL_NAME",
-        "TAMCN_NIIN_QTY_FIE", "TAMCN_NIIN_QTY_POS1", "TAMCN_NIIN_QTY_POS2", "TAMCN_NIIN_QTY_POS3",
-        "TAMCN_NIIN_QTY_BEYOND", "FSC of Part Required", "NIIN of Part Required",
-        "Nomenclature of Part Required", "UNIT_OF_ISSUE",
-        "STANDARD UNIT PRICE", "Required_FIE", "Required_POS1", "Required_POS2", "Required_POS3",
-        "Required_BEYOND", "Total_Required_Less_FIE", "Total_Required_Selected_Confidence",
-        "Value_FIE", "Value_POS1", "Value_POS2", "Value_POS3", "Value_BEYOND",
-        "Total_Value_Less_FIE", "Total_Value_Selected_Confidence", "IND STON", "IND SQFT",
-        "DIM LENGTH INCHES", "DIM WIDTH INCHES", "DIM HEIGHT INCHES"
-    ]
-
-    # Define data types for reading the CSV
-    schema = {
-        'AssessmentNumber': 'str',
-        'Class_of_Supply': 'str',
-        'Region': 'str',
-        'SECREP Flag': 'bool',
-        'Battery Flag': 'bool',
-        'MEF': 'str',
-        'FIE': 'str',
-        'Location Name': 'str',
-        'TAMCN_NIIN': 'str',
-        'TAMCN_of_End_Item': 'str',
-        'NIIN_of_End_Item': 'str',
-        'COLLOQUIAL_NAME': 'str',
-        'FSC of Part Required': 'str',
-        'NIIN of Part Required': 'str',
-        'Nomenclature of Part Required': 'str',
-        'UNIT_OF_ISSUE': 'str',
-        'STANDARD UNIT PRICE': 'float64',
-        'Required_FIE': 'int64',
-        'Required_POS1': 'int64',
-        'Required_POS2': 'int64',
-        'Required_POS3': 'int64',
-        'Required_BEYOND': 'int64',
-        'Total_Required_Less_FIE': 'float64',
-        'Total_Required_Selected_Confidence': 'float64',
-        'Value_FIE': 'float64',
-        'Value_POS1': 'float64',
-        'Value_POS2': 'float64',
-        'Value_POS3': 'float64',
-        'Value_BEYOND': 'float64',
-        'Total_Value_Less_FIE': 'float64',
-        'Total_Value_Selected_Confidence': 'float64',
-        'IND STON': 'float64',
-        'IND SQFT': 'float64',
-        'DIM LENGTH INCHES': 'float64',
-        'DIM WIDTH INCHES': 'float64',
-        'DIM HEIGHT INCHES': 'float64'
+    # Skip only when the existing COSIX Embark CSV file was built from this exact input
+    if is_output_current(s3_client, target_bucket, output_file_path, fingerprint, index):
+        logger.info("Class IX Embark file is up to date")
+        return {
+            'statusCode': 200,
+            'body': 'File already exists',
+            's3_file_path': f's3://{target_bucket}/{output_file_path}'
+        }
+    logger.info("Class IX Embark file does not exist or is stale, creating...")
+    metadata = fingerprint_metadata(fingerprint, TRANSFORM_VERSION)
+
+    # Dimensional lookup prepared at image build time and cached for the life of the container
+    try:
+        df2 = load_classix_lookup()
+    except FileNotFoundError:
+        return {
+            'statusCode': 404,
+            'body': json.dumps('File not found.')
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f'An error occurred: {str(e)}')
+        }
+        
+    logger.info(f"df2 columns from Class IX lookup: {df2.columns.tolist()}")
+
+    # Parse with the registered schema for this input
+    input_name = get_input_name(input_file_path)
+    dtypes = get_input_dtypes(input_name)
+
+    input_size = index.size(source_bucket, input_file_path)
+    if input_size > stream_threshold_bytes:
+        # Each chunk is joined against the cached lookup, reshaped and appended to both outputs;
+        # the CSV upload completes first and the Parquet copy is uploaded after it
+        logger.info(f"Streaming {input_file_path} ({input_size} bytes) in chunks of {chunk_rows} rows")
+        with S3ParquetUpload(s3_client, target_bucket, parquet_file_path, metadata=metadata) as parquet_upload, \
+                S3CsvUpload(s3_client, target_bucket, output_file_path, metadata=metadata) as csv_upload:
+            for df1 in iter_s3_csv(s3_client, source_bucket, input_file_path, chunksize=chunk_rows, dtype=stream_dtypes(dtypes), usecols=INPUT_COLUMNS):
+                cosix_df_final = transform_cosix(df1, df2)
+                parquet_upload.write(cosix_df_final)
+                csv_upload.write(cosix_df_final)
+    else:
+        df1 = read_s3_csv(s3_client, source_bucket, input_file_path, dtype=dtypes, usecols=INPUT_COLUMNS)
+        cosix_df_final = pd.concat(
+            [transform_cosix(df1.iloc[start:start + chunk_rows].copy(), df2) for start in range(0, max(len(df1), 1), chunk_rows)],
+            ignore_index=True
+        )
+
+        # Convert DataFrame to CSV and upload to S3
+        write_s3_csv(s3_client, cosix_df_final, target_bucket, output_file_path, metadata=metadata)
+
+        # Typed Parquet copy for the embark aggregator, which uses it only while it carries the CSV's fingerprint
+        write_s3_parquet(s3_client, cosix_df_final, target_bucket, parquet_file_path, metadata=metadata)
+
+    logger.info("Class IX Embark CSV file has been uploaded to S3.")
+
+    return {
+        'statusCode': 200,
+        'body': 'Processing complete',
+        's3_file_path': f's3://{target_bucket}/{output_file_path}'
     }
 
-    df1 = read_s3_csv(s3_client, source_bucket, input_file_path, dtype=schema, usecols=columns_to_keep)
-    
-    logger.info("df1 columns from AWS S3: f'{df1.columns.tolist()")
+
+def transform_cosix(df1, df2):
+    """Join requirement rows with the dimensional lookup and reshape them to one row per POS level.
+
+    Every output row depends only on its own input row, so the transform can run on the
+    whole file or on row chunks of it.
+    """
+    logger.info(f"df1 columns from AWS S3: {df1.columns.tolist()}")
 
     # Rename columns using a dictionary
     rename_dict1 = {
@@ -150,38 +167,17 @@ def cosix_embark(s3_client, source_bucket, s3_key, assessment_id, target_bucket)
     
     logger.info(f"df1 columns after first transform: {df1.columns.tolist()}")
 
-    # Reading the file from /tmp directory using pandas
-    try:
-        df2 = pd.read_csv(destination_path)
-    except FileNotFoundError:
-        return {
-            'statusCode': 404,
-            'body': json.dumps('File not found.')
-        }
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'body': json.dumps(f'An error occurred: {str(e)}')
-        }
-        
-    logger.info(f"df2 columns from /tmp: {df2.columns.tolist()}")
-
-    # Rename columns in df2 and retain distinct rows based on NIIN and Nomenclature
-    df2 = df2.rename(columns={
-        "UNIT_PRICE": "Unit_Price",
-        "NOMENCLATURE": "Nomenclature"
-    }).drop_duplicates(subset=["NIIN", "Nomenclature"])
-    
-     # Convert all column names to uppercase
-    df2.columns = df2.columns.str.upper()
-    
-    logger.info(f"df2 columns after first transform: {df2.columns.tolist()}")
-
     # Join the DataFrames on NIIN
     cosix_df = pd.merge(df1, df2, on=['NIIN'], suffixes=('_left', '_right'))
     
     logger.info(f"cosix_df columns after join: {cosix_df.columns.tolist()}")
 
+    # Dimension-derived quantities depend only on the NIIN row, not the POS level, so they are
+    # computed once on the narrow frame and carried through the melt
+    cosix_df = add_dimension_columns(cosix_df)
+
+    logger.info(f"cosix_df columns after dimension calculations: {cosix_df.columns.tolist()}")
+
     # Melt the DataFrame to long format for *_POS* and *_BEYOND columns
     pos_columns = [col for col in cosix_df.columns if "_POS" in col or "_BEYOND" in col]
     df_long = cosix_df.melt(
@@ -193,41 +189,12 @@ def cosix_embark(s3_client, source_bucket, s3_key, assessment_id, target_bucket)
     
     logger.info(f"df_long columns after melt: {df_long.columns.tolist()}")
 
-    # Extract base and POS indicator from `variable`
-    df_long[['base', 'POS']] = df_long['variable'].str.extract(r"(.+?)_(POS[0-9]+|BEYOND)")
+    # Extract base and POS indicator from `variable`, parsing each melted column name once
+    df_long[['base', 'POS']] = decode_categories(df_long['variable'], lambda names: names.str.extract(r"(.+?)_(POS[0-9]+|BEYOND)"))
     df_long.drop(columns=['variable'], inplace=True)
 
-    # Replace 0.00 with 0.01 in df_long['DSS_CUBE']
-    df_long['DSS_CUBE'] = np.where(df_long['DSS_CUBE'] == 0.00, 0.01, df_long['DSS_CUBE'])
-
-    # Calculate CUFT (cubic feet) directly in df_long for each NIIN
-    df_long['CUFT'] = np.where(
-        (df_long['DIM LENGTH INCHES'] == 9999) | (df_long['DIM LENGTH INCHES'] == 0) |
-        (df_long['DIM WIDTH INCHES'] == 9999) | (df_long['DIM WIDTH INCHES'] == 0) |
-        (df_long['DIM HEIGHT INCHES'] == 9999) | (df_long['DIM HEIGHT INCHES'] == 0),
-        df_long['DSS_CUBE'],
-        np.maximum(
-            (df_long['DIM LENGTH INCHES'] / 12) *
-            (df_long['DIM WIDTH INCHES'] / 12) *
-            (df_long['DIM HEIGHT INCHES'] / 12),
-            df_long['DSS_CUBE']
-        )
-    )
-
-    # Calculate SQFT (square feet) directly in df_long for each NIIN
-    df_long['SQFT'] = np.where(
-        (df_long['DIM LENGTH INCHES'] == 9999) | (df_long['DIM LENGTH INCHES'] == 0) |
-        (df_long['DIM WIDTH INCHES'] == 9999) | (df_long['DIM WIDTH INCHES'] == 0),
-        0,
-        (df_long['DIM LENGTH INCHES'] / 12) * (df_long['DIM WIDTH INCHES'] / 12)
-    )
-
+    # Weight is the only quantity that scales with the POS requirement
     df_long['Weight_lbs'] = df_long['DSS_WEIGHT'] * df_long['Requirement']
-
-    # Perform FIE-specific calculations for each POS level
-    df_long['FIE_CUFT'] = df_long['CUFT'] * df_long['Required_FIE'] 
-    df_long['FIE_SQFT'] = df_long['SQFT'] * df_long['Required_FIE']
-    df_long['FIE_Weight_lbs'] = df_long['DSS_WEIGHT'] * df_long['Required_FIE']
     
     logger.info(f"df_long columns after calculations: {df_long.columns.tolist()}")
 
@@ -260,29 +227,37 @@ def cosix_embark(s3_client, source_bucket, s3_key, assessment_id, target_bucket)
     
     logger.info(f"cosix_df_final columns: {cosix_df_final.columns.tolist()}")
 
-    # Convert DataFrame to CSV and upload to S3
-    csv_buffer = StringIO()
-    cosix_df_final.to_csv(csv_buffer, index=False)
-    s3_client.put_object(Bucket=target_bucket, Key=output_file_path, Body=csv_buffer.getvalue())
-    logger.info("Class IX Embark CSV file has been uploaded to S3.")
+    return cosix_df_final
 
-    return {
-        'statusCode': 200,
-        'body': 'Processing complete',
-        's3_file_path': f's3://{target_bucket}/{output_file_path}'
-    }
 
+def add_dimension_columns(df):
+    """Add CUFT, SQFT and the FIE quantities from the DIM_* and DSS_* columns of each NIIN row."""
+    # Replace 0.00 with 0.01 in DSS_CUBE
+    df['DSS_CUBE'] = np.where(df['DSS_CUBE'] == 0.00, 0.01, df['DSS_CUBE'])
 
-def lambda_handler(event, context):
-    logger.info("COS IX Embark transformation started")
-    logger.info(f"Received event: {json.dumps(event)}")
+    length = df['DIM LENGTH INCHES']
+    width = df['DIM WIDTH INCHES']
+    height = df['DIM HEIGHT INCHES']
 
-    target_bucket = '{bucket_name}'
-    source_bucket = '{bucket_name}'
-    s3_key = event['s3_key']
-    assessment_id = event['assessment_id']
+    # Calculate CUFT (cubic feet) for each NIIN
+    df['CUFT'] = np.where(
+        (length == 9999) | (length == 0) |
+        (width == 9999) | (width == 0) |
+        (height == 9999) | (height == 0),
+        df['DSS_CUBE'],
+        np.maximum((length / 12) * (width / 12) * (height / 12), df['DSS_CUBE'])
+    )
 
-    result = cosix_embark(s3_client, source_bucket, s3_key, assessment_id, target_bucket)
+    # Calculate SQFT (square feet) for each NIIN
+    df['SQFT'] = np.where(
+        (length == 9999) | (length == 0) |
+        (width == 9999) | (width == 0),
+        0,
+        (length / 12) * (width / 12)
+    )
 
-    logger.info("COS IX Embark File Processed")
-    return result
+    # FIE-specific quantities
+    df['FIE_CUFT'] = df['CUFT'] * df['Required_FIE']
+    df['FIE_SQFT'] = df['SQFT'] * df['Required_FIE']
+    df['FIE_Weight_lbs'] = df['DSS_WEIGHT'] * df['Required_FIE']
+    return df
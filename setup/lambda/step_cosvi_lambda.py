@@ -1,95 +1,117 @@
 import pandas as pd
-import boto3
 import numpy as np
-from io import StringIO
 import logging
-import json
+import re
+from schema_registry import read_input_csv
+from reshape_utils import decode_categories
+from s3_utils import write_s3_csv, write_s3_parquet, input_fingerprint, is_output_current, fingerprint_metadata, S3PrefixIndex
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-s3_client = boto3.client('s3')
+# Bump when the transform logic changes so existing outputs are rebuilt
+TRANSFORM_VERSION = '2'
 
+# Identifier columns the transform reads alongside the POS/NIIN_Qty metrics
+ID_COLUMNS = ["AssessmentNumber", "Class_of_Supply", "Region", "Location_ID", "Location_Name", "HCP_Type", "NIIN", "Region_MEF_Lead"]
 
-def read_s3_csv(s3_client, bucket_name, object_key, dtype=None):
-    """Utility function to read CSV from S3."""
-    obj = s3_client.get_object(Bucket=bucket_name, Key=object_key)
-    return pd.read_csv(StringIO(obj['Body'].read().decode('utf-8')), dtype=dtype)
 
+# Pivot keys, in the order the reshaped rows are sorted
+PIVOT_INDEX = ["AssessmentNumber", "Class_of_Supply", "Region", "Location_ID", "Location_Name", "Region_MEF_Lead", "POS", "HCP_Type", "NIIN"]
 
-def check_file_exists(s3_client, bucket, key):
-    """Check if a file exists in S3."""
-    s3_client.head_object(Bucket=bucket, Key=key)
+# POS level and metric name parsed from each value column, e.g. DOS1_Units_NIIN_Qty_Pallet_Qty -> (DOS1, Qty_Pallet_Qty)
+POS_PATTERN = re.compile(r"(POS\d|DOS\d)")
+METRIC_PREFIX_PATTERN = re.compile(r"^(DOS\d_Units_NIIN_|POS\d_Units_NIIN_|POS\d_Units_|Pallet_|POS\d_)")
+
+
+def is_value_column(col):
+    return col.startswith("POS") or "NIIN_Qty" in col
+
+
+def is_input_column(col):
+    """Return True for the columns the COS VI reshape reads."""
+    return col in ID_COLUMNS or is_value_column(col)
+
+
+def parse_metric_columns(columns):
+    """Split value column names into (column, POS, Metric_Type); names without a POS/DOS level are left out."""
+    parsed = []
+    for col in columns:
+        match = POS_PATTERN.search(col)
+        if match:
+            parsed.append((col, match.group(1), METRIC_PREFIX_PATTERN.sub("", col)))
+        else:
+            logger.warning(f"No POS level in column {col}; it is left out of the reshape.")
+    return parsed
+
+
+def pivot_metrics(cosvi_df):
+    """Reshape the wide POS/DOS metric columns to one row per PIVOT_INDEX key and one column per metric.
+
+    Matches melt_pivot_metrics (melt, regex extract/replace, pivot_table with aggfunc="first")
+    but parses each column name once and moves the data with a single stack of the POS level:
+    rows with a missing key or no values are dropped, duplicate keys keep their first non-null
+    value, and rows and metric columns come out sorted.
+    """
+    parsed = parse_metric_columns([col for col in cosvi_df.columns if is_value_column(col)])
+    columns = pd.MultiIndex.from_tuples([(pos, metric) for _, pos, metric in parsed], names=["POS", "Metric_Type"])
+    if columns.has_duplicates:
+        logger.warning("Value columns share a POS and Metric_Type; falling back to melt and pivot_table.")
+        return melt_pivot_metrics(cosvi_df)
+
+    wide = cosvi_df.set_index(ID_COLUMNS)[[col for col, _, _ in parsed]]
+    wide.columns = columns
+
+    long_df = wide.stack(level="POS", future_stack=True).reorder_levels(PIVOT_INDEX)
+
+    # pivot_table drops rows with a missing key (code -1)
+    has_keys = (np.vstack(long_df.index.codes) != -1).all(axis=0)
+    long_df = long_df[has_keys]
+
+    if long_df.index.has_duplicates:
+        long_df = long_df.groupby(level=PIVOT_INDEX, observed=True, sort=False).first()
+
+    long_df = long_df.dropna(how="all").dropna(how="all", axis=1)
+    long_df = long_df.sort_index().sort_index(axis=1).reset_index()
+
+    # POS is a low-cardinality dimension, categorical like the other POS columns
+    long_df["POS"] = long_df["POS"].astype("category")
+    return long_df
+
+
+def melt_pivot_metrics(cosvi_df):
+    """Reference reshape: melt every value column, parse each melted row and pivot back."""
+    value_vars = [col for col in cosvi_df.columns if is_value_column(col)]
+    cosvi_df_long = pd.melt(cosvi_df, id_vars=ID_COLUMNS, value_vars=value_vars, var_name="Metric", value_name="Value")
+
+    # Each distinct metric name is parsed once and mapped back to the melted rows
+    metric = cosvi_df_long["Metric"].astype("category")
+    cosvi_df_long["POS"] = decode_categories(metric, lambda names: names.str.extract(POS_PATTERN.pattern, expand=False))
+    cosvi_df_long["Metric_Type"] = decode_categories(metric, lambda names: names.str.replace(METRIC_PREFIX_PATTERN.pattern, "", regex=True))
+
+    return cosvi_df_long.pivot_table(
+        index=PIVOT_INDEX,
+        columns="Metric_Type",
+        values="Value",
+        aggfunc="first",
+        observed=True
+    ).reset_index()
 
 
 def cosvi_embark(s3_client, source_bucket, s3_key, assessment_id, target_bucket):
     """Process COS VI Embark data."""
-    # Define data types for reading the CSV
-    schema = {
-        'AssessmentNumber': 'str',
-        'Class_of_Supply': 'str',
-        'HCP_Type': 'str',
-        'DESCRIPTION': 'str',
-        'TAMCN': 'str',
-        'FSC': 'str',
-        'NIIN': 'str',
-        'NSN': 'str',
-        'TPFDD_TAMCN': 'str',
-        'TPFDD_NSN': 'str',
-        'Description': 'str',
-        'Region': 'str',
-        'Region_MEF_Lead': 'str',
-        'CAP_Name': 'str',
-        'CAP_Names': 'str',
-        'Location_ID': 'str',
-        'Location_Name': 'str',
-        'Unit of Issue': 'str',
-        'DOS1_Units': 'float64',
-        'DOS2_Units': 'float64',
-        'DOS3_Units': 'float64',
-        'DOS1_Units_NIIN_Qty': 'float64',
-        'DOS2_Units_NIIN_Qty': 'float64',
-        'DOS3_Units_NIIN_Qty': 'float64',
-        'DOS1_Units_NIIN_Qty_Pallet_Qty': 'float64',
-        'DOS2_Units_NIIN_Qty_Pallet_Qty': 'float64',
-        'DOS3_Units_NIIN_Qty_Pallet_Qty': 'float64',
-        'DOS1_Units_NIIN_Qty_Pallet_Tot_CuFT': 'float64',
-        'DOS2_Units_NIIN_Qty_Pallet_Tot_CuFT': 'float64',
-        'DOS3_Units_NIIN_Qty_Pallet_Tot_CuFT': 'float64',
-        'DOS1_Units_NIIN_Qty_Pallet_Tot_Wt(lbs)': 'float64',
-        'DOS2_Units_NIIN_Qty_Pallet_Tot_Wt(lbs)': 'float64',
-        'DOS3_Units_NIIN_Qty_Pallet_Tot_Wt(lbs)': 'float64',
-        'DOS1_Units_NIIN_Qty_Pallet_Tot_TEUs': 'float64',
-        'DOS2_Units_NIIN_Qty_Pallet_Tot_TEUs': 'float64',
-        'DOS3_Units_NIIN_Qty_Pallet_Tot_TEUs': 'float64',
-        'DOS1_Units_NIIN_Qty_Pallet_Tot_FEUs': 'float64',
-        'DOS2_Units_NIIN_Qty_Pallet_Tot_FEUs': 'float64',
-        'DOS3_Units_NIIN_Qty_Pallet_Tot_FEUs': 'float64',
-    }
-
     # Define file paths
     input_file_path = s3_key
     output_file_path = f'assessments/{assessment_id}/cosvi_embark.csv'
+    parquet_file_path = f'assessments/{assessment_id}/cosvi_embark.parquet'
 
-    # Check for the existence of the COS VI Embark CSV file
-    try:
-        s3_client.head_object(Bucket=target_bucket, Key=output_file_path)
-        logger.info("Class VI Embark file already exists.")
-        return {
-            'statusCode': 200,
-            'body': 'File already exists',
-            's3_file_path': f's3://{target_bucket}/{output_file_path}'
-        }
-    except s3_client.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            logger.info("Class VI Embark file does not exist, creating...")
-        else:
-            raise
+    # One listing of the assessment prefix answers the input and output lookups
+    index = S3PrefixIndex(s3_client, f'assessments/{assessment_id}/')
 
-    # Check for the input file to be available
+    # Fingerprint the input file; a missing input is reported before any work is done
     try:
-        check_file_exists(s3_client, source_bucket, input_file_path)
+        fingerprint = input_fingerprint(s3_client, [(source_bucket, input_file_path)], TRANSFORM_VERSION, index)
     except s3_client.exceptions.ClientError as e:
         if e.response['Error']['Code'] == '404':
             logger.error(f"Input file {input_file_path} does not exist.")
@@ -100,64 +122,30 @@ def cosvi_embark(s3_client, source_bucket, s3_key, assessment_id, target_bucket)
         else:
             raise
 
-    # Read data from S3
-    cosvi_df = read_s3_csv(s3_client, source_bucket, object_key=input_file_path, dtype=schema)
-    
-    logger.info(f"cosvi_df: {cosvi_df.columns.tolist()}")
-
-    # Define identifier and value columns
-    id_vars = ["AssessmentNumber", "Class_of_Supply", "Region", "Location_ID", "Location_Name", "HCP_Type", "NIIN", "Region_MEF_Lead"]
-    value_vars = [col for col in cosvi_df.columns if col.startswith("POS") or "NIIN_Qty" in col]
+    # Skip only when the existing COS VI Embark CSV file was built from this exact input
+    if is_output_current(s3_client, target_bucket, output_file_path, fingerprint, index):
+        logger.info("Class VI Embark file is up to date")
+        return {
+            'statusCode': 200,
+            'body': 'File already exists',
+            's3_file_path': f's3://{target_bucket}/{output_file_path}'
+        }
+    logger.info("Class VI Embark file does not exist or is stale, creating...")
+    metadata = fingerprint_metadata(fingerprint, TRANSFORM_VERSION)
 
-    # Melt the dataframe to long format
-    cosvi_df_long = pd.melt(cosvi_df, id_vars=id_vars, value_vars=value_vars, var_name="Metric", value_name="Value")
+    # Read data from S3 with the registered schema for this input
+    cosvi_df = read_input_csv(s3_client, source_bucket, input_file_path, usecols=is_input_column)
     
-    logger.info(f"cosvi_df_long after melt: {cosvi_df_long.columns.tolist()}")
-    logger.info(f"Unique metrics in cosvi_df_long['Metric']: {cosvi_df_long['Metric'].unique()}")
+    logger.info(f"cosvi_df: {cosvi_df.columns.tolist()}")
 
-    # Log unique Metric values before transformation
-    logger.info(f"Unique metrics in cosvi_df_long['Metric']: {cosvi_df_long['Metric'].unique().tolist()}")
-    
-    # Check if the 'Metric' column exists in cosvi_df_long
-    if "Metric" not in cosvi_df_long.columns:
-        raise KeyError("'Metric' column is missing in cosvi_df_long.")
-    
-    # Extract POS and Metric_Type from Metric
-    cosvi_df_long["POS"] = cosvi_df_long["Metric"].str.extract(r"(POS\d|DOS\d)")
-    
-    # Check for any null values in 'POS' after extraction
-    if cosvi_df_long["POS"].isnull().any():
-        logger.warning("Null values found in 'POS' after extraction. Check the 'Metric' column for unexpected patterns.")
-        logger.info(f"Rows with null 'POS':\n{cosvi_df_long[cosvi_df_long['POS'].isnull()]}")
-    
-    # Transform Metric_Type
-    cosvi_df_long["Metric_Type"] = cosvi_df_long["Metric"].str.replace(
-        r"^(DOS\d_Units_NIIN_|POS\d_Units_NIIN_|POS\d_Units_|Pallet_|POS\d_)", "", regex=True
-    )
-    
-    # Log unique Metric_Type values after transformation
-    logger.info(f"Unique Metric_Types after transformation: {cosvi_df_long['Metric_Type'].unique().tolist()}")
-    
-    # Check for any null or empty Metric_Type values
-    if cosvi_df_long["Metric_Type"].isnull().any():
-        logger.warning("Null values found in 'Metric_Type' after transformation.")
-        logger.info(f"Rows with null 'Metric_Type':\n{cosvi_df_long[cosvi_df_long['Metric_Type'].isnull()]}")
-    if (cosvi_df_long["Metric_Type"] == "").any():
-        logger.warning("Empty string values found in 'Metric_Type' after transformation.")
-    
-
-    logger.info(f"Unique Metric_Types before pivot: {cosvi_df_long['Metric_Type'].unique()}")
-
-    # Pivot the data back to wide format
-    cosvi_df_final = cosvi_df_long.pivot_table(
-        index=["AssessmentNumber", "Class_of_Supply", "Region", "Location_ID", "Location_Name", "Region_MEF_Lead", "POS", "HCP_Type", "NIIN"],
-        columns="Metric_Type",
-        values="Value",
-        aggfunc="first"
-    ).reset_index()
+    # One row per location, NIIN and POS with one column per metric
+    cosvi_df_final = pivot_metrics(cosvi_df)
     
     logger.info(f"cosvi_df_final after pivot: {cosvi_df_final.columns.tolist()}")
 
+    # Keep rows where Weight_lbs > 0 before the derived columns are added
+    cosvi_df_final = cosvi_df_final[cosvi_df_final["Qty_Pallet_Tot_Wt(lbs)"] > 0]
+
     # Rename columns
     cosvi_df_final.rename(columns={
         "HCP_Type": "COS_Type",
@@ -189,9 +177,6 @@ def cosvi_embark(s3_client, source_bucket, s3_key, assessment_id, target_bucket)
         default=0
     )
 
-    # Filter rows where Weight_lbs > 0
-    cosvi_df_final = cosvi_df_final[cosvi_df_final["Weight_lbs"] > 0]
-    
     logger.info(f"cosvi_df_final after calcs: {cosvi_df_final.columns.tolist()}")
 
     # Select and arrange final columns
@@ -208,45 +193,15 @@ def cosvi_embark(s3_client, source_bucket, s3_key, assessment_id, target_bucket)
     cosvi_df_final.columns = cosvi_df_final.columns.str.upper()
 
     # Convert DataFrame to CSV and upload to S3
-    csv_buffer = StringIO()
-    cosvi_df_final.to_csv(csv_buffer, index=False)
-    s3_client.put_object(Bucket=target_bucket, Key=output_file_path, Body=csv_buffer.getvalue())
+    write_s3_csv(s3_client, cosvi_df_final, target_bucket, output_file_path, metadata=metadata)
     logger.info("Class VI Embark CSV file has been uploaded to S3.")
 
+    # Typed Parquet copy for the embark aggregator, which uses it only while it carries the CSV's fingerprint
+    write_s3_parquet(s3_client, cosvi_df_final, target_bucket, parquet_file_path, metadata=metadata)
+
     # Return the S3 file path
     return {
         'statusCode': 200,
         'body': 'Processing complete',
         's3_file_path': f's3://{target_bucket}/{output_file_path}'
     }
-
-
-def lambda_handler(event, context):
-    """Lambda function entry point."""
-    logger.info("COS VI Embark transformation started.")
-    # Log the received event
-    logger.info(f"Received event: {json.dumps(event)}")
-
-    target_bucket = '{bucket_name}'
-    source_bucket = '{bucket_name}'
-    s3_key = event.get('s3_key', '')
-    assessment_id = event.get('assessment_id', '')
-
-    if not s3_key or not assessment_id:
-        logger.error("Missing required keys: 's3_key' or 'assessment_id'")
-        return {
-            'statusCode': 400,
-            'body': "Missing required keys: 's3_key' or 'assessment_id'"
-        }
-
-    try:
-        result = cosvi_embark(s3_client, source_bucket, s3_key, assessment_id, target_bucket)
-        logger.info("COS VI Embark File Processed.")
-        return result
-
-    except Exception as e:
-        logger.error(f"Error processing COS VI Embark: {str(e)}")
-        return {
-            'statusCode': 500,
-            'body': f"Error processing COS VI Embark: {str(e)}"
-        }
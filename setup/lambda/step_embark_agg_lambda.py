@@ -1,11 +1,13 @@
 import os
 import json
+import time
 import logging
 import pandas as pd
-import boto3
-from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from aws_clients import lazy_client
 from datetime import datetime
 from botocore.exceptions import ClientError
+from s3_utils import read_s3_csv, read_s3_parquet, write_s3_csv, write_s3_parquet, input_fingerprint, is_output_current, fingerprint_metadata, S3PrefixIndex, numpy_frame, FINGERPRINT_METADATA_KEY
 
 
 # Set up logging
@@ -13,14 +15,35 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # Initialize clients
-s3_client = boto3.client('s3')
-dynamodb_client = boto3.client('dynamodb')
+s3_client = lazy_client('s3')
+dynamodb_client = lazy_client('dynamodb')
 
 # Configuration
 dynamodb_table = os.getenv('DYNAMODB_TABLE', 'imat-dashboard-datasets')
 aws_account_id = os.getenv('AWS_ACCOUNT_ID', 'xxxxxxxxxxxx')
 region = os.getenv('AWS_REGION', 'us-east-1')
 
+# Embark files fetched and parsed at once
+max_read_workers = int(os.getenv('EMBARK_AGG_MAX_WORKERS', '8'))
+
+# Aggregate layout: '' writes one aggregated_embark.csv; 'class' writes one part per embark class and
+# 'rows' parts of at most EMBARK_AGG_PARTITION_ROWS rows, listed by aggregated_embark.manifest.json
+partition_by = os.getenv('EMBARK_AGG_PARTITION_BY', '')
+partition_rows = int(os.getenv('EMBARK_AGG_PARTITION_ROWS', '1000000'))
+max_write_workers = int(os.getenv('EMBARK_AGG_MAX_WRITE_WORKERS', '4'))
+
+# Bump when read_and_process_file or the part layout changes so cached partitions, parts and the aggregate are rebuilt
+TRANSFORM_VERSION = '2'
+
+# Compact sums published beside the aggregate, one CSV per grain the Embark sheet visuals group by;
+# each is picked up by the preprocessor and published as its own SPICE dataset
+ROLLUP_GRAINS = {
+    'embark_rollup_region': ['CLASS_OF_SUPPLY', 'REGION'],
+    'embark_rollup_location': ['CLASS_OF_SUPPLY', 'REGION', 'LOCATION_NAME'],
+    'embark_rollup_pos': ['CLASS_OF_SUPPLY', 'POS']
+}
+ROLLUP_METRICS = ['CUFT', 'SQFT', 'TEUS', 'WEIGHT_LBS', 'TOTAL_COST']
+
 
 def parse_s3_path(s3_path):
     parsed_url = s3_path.replace("s3://", "").split("/", 1)
@@ -29,54 +52,220 @@ def parse_s3_path(s3_path):
     return bucket_name, key
 
 
-def list_s3_files(s3_client, bucket_name, prefix):
-    """Utility function to list all files in an S3 bucket with a specific prefix."""
-    try:
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-        if 'Contents' in response:
-            return [item['Key'] for item in response['Contents']]
+def find_embark_files(s3_client, index, bucket_name, assessment_id):
+    """Return the s3:// paths of the class embark outputs of an assessment, in key order.
+
+    The class Lambdas write cos*_embark.csv (and a Parquet copy) at the top of the
+    assessment folder; `index` lists that level only, so the extracted/ and
+    cos-calculators/ subtrees are never scanned. The Parquet copy is preferred when it
+    carries the same input fingerprint as the CSV, so a copy left over from an earlier
+    input (or one whose upload failed after the CSV's) is never read in its place.
+    """
+    prefix = f"assessments/{assessment_id}/cos"
+    keys = [key for key in index.keys(bucket_name) if key.startswith(prefix)]
+    key_set = set(keys)
+    csv_keys = [key for key in keys if key.endswith('embark.csv')]
+    copies = [key for key in csv_keys if key[:-len('.csv')] + '.parquet' in key_set]
+
+    def copy_is_current(csv_key):
+        fingerprints = [
+            s3_client.head_object(Bucket=bucket_name, Key=key).get('Metadata', {}).get(FINGERPRINT_METADATA_KEY)
+            for key in (csv_key, csv_key[:-len('.csv')] + '.parquet')
+        ]
+        return fingerprints[0] is not None and fingerprints[0] == fingerprints[1]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_read_workers, len(copies)))) as executor:
+        current_copies = {key for key, current in zip(copies, executor.map(copy_is_current, copies)) if current}
+
+    embark_paths = []
+    for key in csv_keys:
+        if key in current_copies:
+            embark_key = key[:-len('.csv')] + '.parquet'
         else:
-            return []
-    except Exception as e:
-        logger.error(f"Error listing files in bucket {bucket_name} with prefix {prefix}: {e}")
-        return []
+            if key in copies:
+                logger.info(f"Parquet copy of {key} does not match the CSV, reading the CSV")
+            embark_key = key
+        embark_paths.append(f"s3://{bucket_name}/{embark_key}")
+    return embark_paths
+
+
+def partition_key(assessment_id, embark_key):
+    """Key of the cached aggregate partition built from an embark file, e.g. .../aggregated_embark_parts/cosiv_embark.parquet"""
+    name = os.path.splitext(os.path.basename(embark_key))[0]
+    return f"assessments/{assessment_id}/aggregated_embark_parts/{name}.parquet"
 
 
-def read_s3_csv(s3_client, bucket_name, key):
-    """Utility function to read CSV from S3."""
-    response = s3_client.get_object(Bucket=bucket_name, Key=key)
-    return pd.read_csv(StringIO(response['Body'].read().decode('utf-8')))
+def aggregate_key(assessment_id):
+    """Key the Step Function and the preprocessor see for the aggregate: the CSV, or the manifest listing its parts."""
+    if partition_by:
+        return f"assessments/{assessment_id}/aggregated_embark.manifest.json"
+    return f"assessments/{assessment_id}/aggregated_embark.csv"
+
+
+def part_csv_key(assessment_id, name):
+    """Key of an aggregate CSV part, e.g. .../aggregated_embark_parts/cosiv_embark.part.csv
+
+    The .part.csv suffix keeps parts clear of the cos*_embark.csv bucket notifications.
+    """
+    return f"assessments/{assessment_id}/aggregated_embark_parts/{name}.part.csv"
+
+
+def rollup_key(assessment_id, name):
+    """Key of a rollup CSV, e.g. assessments/{id}/embark_rollup_region.csv"""
+    return f"assessments/{assessment_id}/{name}.csv"
+
+
+def build_rollups(aggregated_df):
+    """Return {name: DataFrame} with the ROLLUP_METRICS summed at each ROLLUP_GRAINS grain."""
+    rollups = {}
+    for name, grain in ROLLUP_GRAINS.items():
+        df = aggregated_df.reindex(columns=grain + ROLLUP_METRICS)
+        rollups[name] = df.groupby(grain, observed=True, dropna=False)[ROLLUP_METRICS].sum().reset_index()
+    return rollups
+
+
+def csv_dtypes(df):
+    """Return `df` with the dtypes read_csv gives the embark CSVs.
+
+    The Parquet copies keep the registry's categorical dimensions (and Arrow types with
+    that backend). A categorical cannot take the 0 that fillna writes into missing
+    values, and concat only decodes categoricals when the frames' categories differ,
+    so they are decoded to plain values before a partition is cached or concatenated.
+    Partitions cached before that are normalised the same way when they are read back.
+    """
+    df = numpy_frame(df)
+    categorical = [col for col, col_dtype in df.dtypes.items() if isinstance(col_dtype, pd.CategoricalDtype)]
+    if categorical:
+        df = df.astype({col: object for col in categorical})
+    return df
 
 
 def read_and_process_file(s3_client, s3_path):
     bucket_name, key = parse_s3_path(s3_path)
-    df = read_s3_csv(s3_client, bucket_name, key)
-    df.columns = df.columns.str.strip().str.upper()
     required_columns = ['CLASS_OF_SUPPLY', 'REGION', 'LOCATION_NAME',
                         'POS', 'CUFT', 'SQFT', 'TEUS', 'WEIGHT_LBS', 'TOTAL_COST'] 
+    if key.endswith('.parquet'):
+        # Typed copy written by the class Lambdas; only the required columns are decoded
+        df = read_s3_parquet(s3_client, bucket_name, key, columns=required_columns)
+    else:
+        # Headers are matched after normalising, so only the required columns are parsed
+        df = read_s3_csv(s3_client, bucket_name, key, usecols=lambda col: col.strip().upper() in required_columns)
+        df.columns = df.columns.str.strip().str.upper()
     df = df.reindex(columns=required_columns, fill_value=0)
     return df
   
 
-def agg_embark_files(bucket_name, embark_paths, output_file_path):
-  
-    aggregated_df = pd.DataFrame()
-    for s3_path in embark_paths:
-        try:
-            logger.info(f"Processing file: {s3_path}")
-            df = read_and_process_file(s3_client, s3_path)
-            logger.info(f"Processed {len(df)} rows from {s3_path}")
-            aggregated_df = pd.concat([aggregated_df, df], ignore_index=True)
-        except Exception as e:
-            logger.error(f"Error processing file {s3_path}: {e}")
+def read_partition(s3_client, assessment_id, s3_path, index):
+    """Return (DataFrame or None, stats) for one embark file; never raises.
 
+    The processed rows are cached as a Parquet partition fingerprinted with the ETag of
+    the embark file. A current partition is read instead of the embark file; a stale or
+    missing one is rebuilt and replaced.
+    """
+    start = time.perf_counter()
+    bucket_name, key = parse_s3_path(s3_path)
+    part_key = partition_key(assessment_id, key)
+    try:
+        fingerprint = input_fingerprint(s3_client, [(bucket_name, key)], TRANSFORM_VERSION, index)
+        cached = is_output_current(s3_client, bucket_name, part_key, fingerprint)
+        if cached:
+            df = csv_dtypes(read_s3_parquet(s3_client, bucket_name, part_key))
+        else:
+            df = csv_dtypes(read_and_process_file(s3_client, s3_path))
+            write_s3_parquet(s3_client, df, bucket_name, part_key, metadata=fingerprint_metadata(fingerprint, TRANSFORM_VERSION))
+    except Exception as e:
+        logger.error(f"Error processing file {s3_path}: {e}")
+        return None, {'s3_path': s3_path, 'rows': 0, 'seconds': round(time.perf_counter() - start, 3), 'error': str(e)}
+    seconds = round(time.perf_counter() - start, 3)
+    logger.info(f"{'Read cached partition for' if cached else 'Processed'} {len(df)} rows from {s3_path} in {seconds}s")
+    return df, {'s3_path': s3_path, 'rows': len(df), 'seconds': seconds, 'cached': cached}
+
+
+def write_csv_part(bucket_name, part_key, df, fingerprint):
+    """Upload one aggregate part unless the existing part was built from the same fingerprint."""
+    if is_output_current(s3_client, bucket_name, part_key, fingerprint):
+        logger.info(f"Aggregate part {part_key} is up to date")
+        return part_key
+    write_s3_csv(s3_client, df, bucket_name, part_key, metadata=fingerprint_metadata(fingerprint, TRANSFORM_VERSION))
+    logger.info(f"Aggregate part {part_key} ({len(df)} rows) has been uploaded to S3.")
+    return part_key
+
+
+def plan_parts(assessment_id, results, aggregated_df, fingerprint, index):
+    """Return (part_key, DataFrame, fingerprint) for each aggregate part, in aggregate row order.
+
+    Together the parts hold exactly the rows of the single CSV. 'class' parts carry the
+    fingerprint of their embark file, so only the classes that changed are uploaded
+    again; each is normalised from its own partition rather than sliced from the
+    concatenation, whose dtypes (and so the part's number formatting) depend on the
+    other classes. 'rows' parts are slices of `aggregated_df` that shift with every
+    change and carry the fingerprint of the whole aggregate.
+    """
+    if partition_by == 'class':
+        parts = []
+        for df, stats in results:
+            if df is None:
+                continue
+            bucket_name, key = parse_s3_path(stats['s3_path'])
+            name = os.path.splitext(os.path.basename(key))[0]
+            part_fingerprint = input_fingerprint(s3_client, [(bucket_name, key)], TRANSFORM_VERSION, index)
+            parts.append((part_csv_key(assessment_id, name), csv_dtypes(df).fillna(0), part_fingerprint))
+        return parts
+    if partition_by == 'rows':
+        return [
+            (part_csv_key(assessment_id, f"rows-{number:05d}"), aggregated_df.iloc[start:start + partition_rows], fingerprint)
+            for number, start in enumerate(range(0, max(len(aggregated_df), 1), partition_rows))
+        ]
+    raise ValueError(f"Unknown EMBARK_AGG_PARTITION_BY {partition_by}")
+
+
+def write_manifest(bucket_name, manifest_key, part_keys, metadata=None):
+    """Upload a QuickSight manifest listing every part; written last, it is what triggers the preprocessor."""
+    manifest_json = {
+        "entries": [{"url": f"s3://{bucket_name}/{part_key}", "mandatory": True} for part_key in part_keys]
+    }
+    s3_client.put_object(Bucket=bucket_name, Key=manifest_key, Body=json.dumps(manifest_json, indent=4),
+                         ContentType='application/json', Metadata=metadata or {})
+    logger.info(f"Aggregated Embark manifest with {len(part_keys)} parts has been uploaded to S3 at {manifest_key}.")
+
+
+def agg_embark_files(bucket_name, assessment_id, embark_paths, output_file_path, index, metadata=None, fingerprint=None):
+    """Load every embark partition in parallel, concatenate once and upload the aggregate and its rollups.
+
+    Only partitions whose embark file changed are rebuilt from it (see read_partition).
+    Frames are concatenated in `embark_paths` order. Files that fail to read are left
+    out. With EMBARK_AGG_PARTITION_BY set, the aggregate is uploaded as parts in parallel
+    and `output_file_path` is the manifest listing them; the other layout is removed so
+    only one is ever current. Returns the per-file stats: path, rows, seconds, whether
+    the cached partition was used and any error.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(max_read_workers, len(embark_paths)))) as executor:
+        results = list(executor.map(lambda s3_path: read_partition(s3_client, assessment_id, s3_path, index), embark_paths))
+
+    frames = [df for df, _ in results if df is not None]
+    aggregated_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
     aggregated_df.fillna(0, inplace=True)
-    
-    # Convert DataFrame to CSV and upload to S3
-    csv_buffer = StringIO()
-    aggregated_df.to_csv(csv_buffer, index=False)
-    s3_client.put_object(Bucket=bucket_name, Key=output_file_path, Body=csv_buffer.getvalue())
-    logger.info(f"Aggregated Embark file has been uploaded to S3 at {output_file_path}.")
+
+    if partition_by:
+        parts = plan_parts(assessment_id, results, aggregated_df, fingerprint, index)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_write_workers, len(parts)))) as executor:
+            part_keys = list(executor.map(lambda part: write_csv_part(bucket_name, *part), parts))
+        write_manifest(bucket_name, output_file_path, part_keys, metadata)
+        stale_key = f"assessments/{assessment_id}/aggregated_embark.csv"
+    else:
+        # Convert DataFrame to CSV and upload to S3
+        write_s3_csv(s3_client, aggregated_df, bucket_name, output_file_path, metadata=metadata)
+        logger.info(f"Aggregated Embark file has been uploaded to S3 at {output_file_path}.")
+        stale_key = f"assessments/{assessment_id}/aggregated_embark.manifest.json"
+
+    if index.exists(bucket_name, stale_key):
+        s3_client.delete_object(Bucket=bucket_name, Key=stale_key)
+        logger.info(f"Removed the previous aggregate layout {stale_key}.")
+
+    for name, rollup_df in build_rollups(aggregated_df).items():
+        write_s3_csv(s3_client, rollup_df, bucket_name, rollup_key(assessment_id, name), metadata=metadata)
+        logger.info(f"Embark rollup {name} ({len(rollup_df)} rows) has been uploaded to S3.")
+    return [stats for _, stats in results]
 
 
 def update_embark_agg_status(dynamodb_client, dynamodb_table, assessment_id, dataset_id):
@@ -118,30 +307,36 @@ def lambda_handler(event, context):
     dataset_name = f'aggregated_embark_dataset_{assessment_id}'
     file_id = f'aggregated-embark'
     file_name = f'aggregated_embark.csv'
-    output_file_path = f"assessments/{assessment_id}/aggregated_embark.csv"
+    output_file_path = aggregate_key(assessment_id)
 
 
     try:
         
-        # List all cos*embark.csv files in the source bucket
-        prefix = f"assessments/{assessment_id}/"
-        
-        embark_paths = []
-  
-        for key in list_s3_files(s3_client, bucket_name, prefix):
-            if key.startswith(f'{prefix}cos') and key.endswith('embark.csv'):
-                embark_path = f"s3://{bucket_name}/{key}"
-                embark_paths.append(embark_path)
-                logger.info(f"Selected for processing: {embark_path}")
+        # One listing of the top of the assessment folder finds the embark files and their ETags
+        index = S3PrefixIndex(s3_client, f"assessments/{assessment_id}/", delimiter='/')
+        embark_paths = find_embark_files(s3_client, index, bucket_name, assessment_id)
+        for embark_path in embark_paths:
+            logger.info(f"Selected for processing: {embark_path}")
         
         if not embark_paths:
             raise Exception("No embark files found to process.")
         
         logger.info(f"Embark S3 Paths: {json.dumps(embark_paths)}")
         
-        object_key = f"assessments/{assessment_id}/aggregated_embark.csv"
-        
-        agg_embark_files(bucket_name, embark_paths, output_file_path)
+        object_key = output_file_path
+
+        # Skip the rebuild when the aggregate and its rollups were built from these exact embark files
+        embark_inputs = [parse_s3_path(embark_path) for embark_path in embark_paths]
+        fingerprint = input_fingerprint(s3_client, embark_inputs, TRANSFORM_VERSION, index)
+        output_keys = [output_file_path] + [rollup_key(assessment_id, name) for name in ROLLUP_GRAINS]
+        if all(is_output_current(s3_client, bucket_name, key, fingerprint, index) for key in output_keys):
+            logger.info("Aggregated Embark file is up to date")
+            body = 'Aggregated Embark file is up to date'
+            files = []
+        else:
+            metadata = fingerprint_metadata(fingerprint, TRANSFORM_VERSION)
+            files = agg_embark_files(bucket_name, assessment_id, embark_paths, output_file_path, index, metadata, fingerprint)
+            body = 'Aggregated Embark File Processing complete'
         
         # Update aggregation embark completion status in DynamoDB
         update_embark_agg_status(dynamodb_client, dynamodb_table, assessment_id, dataset_id)
@@ -149,8 +344,11 @@ def lambda_handler(event, context):
         # Return the S3 file path
         return {
             'statusCode': 200,
-            'body': 'Aggregated Embark File Processing complete',
-            's3_file_path': f's3://{bucket_name}/{object_key}'
+            'body': body,
+            's3_file_path': f's3://{bucket_name}/{object_key}',
+            'rollups': [f's3://{bucket_name}/{rollup_key(assessment_id, name)}' for name in ROLLUP_GRAINS],
+            'rows': sum(stats['rows'] for stats in files),
+            'files': files
         }
 
     except Exception as e:
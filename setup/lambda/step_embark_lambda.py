@@ -0,0 +1,74 @@
+import os
+from aws_clients import lazy_client
+import logging
+import json
+from embark_engine import run_embark_spec, spec_for_file
+from step_cosvi_lambda import cosvi_embark
+from step_cosix_lambda import cosix_embark
+from s3_utils import process_batch
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3_client = lazy_client('s3')
+
+# Classes whose transforms are still written in code; every other class is served from embark_specs.json
+CODE_TRANSFORMS = {
+    'RD_VI_POS_Pallet_Requirement.csv': cosvi_embark,
+    'RD_IX_Requirement.csv': cosix_embark
+}
+
+
+def embark(s3_client, file_name, source_bucket, s3_key, assessment_id, target_bucket):
+    """Run the embark transform for the class whose input is `file_name`."""
+    if file_name in CODE_TRANSFORMS:
+        return CODE_TRANSFORMS[file_name](s3_client, source_bucket, s3_key, assessment_id, target_bucket)
+
+    spec_name = spec_for_file(file_name)
+    if spec_name is None:
+        raise ValueError(f"No embark transform for {file_name}")
+    return run_embark_spec(spec_name, s3_client, source_bucket, s3_key, assessment_id, target_bucket)
+
+
+def lambda_handler(event, context):
+    """Lambda function entry point shared by every embark class."""
+    logger.info("Embark transformation started.")
+    # Log the received event
+    logger.info(f"Received event: {json.dumps(event)}")
+
+    target_bucket = '{bucket_name}'
+    source_bucket = '{bucket_name}'
+    s3_key = event.get('s3_key', '')
+    assessment_id = event.get('assessment_id', '')
+    file_name = event.get('file_name') or os.path.basename(s3_key)
+
+    # Batch mode: {"assessments": [{"s3_key": ..., "assessment_id": ..., "file_name": ...}, ...]} in one warm container
+    if 'assessments' in event:
+        return process_batch(
+            s3_client, event['assessments'],
+            lambda client, item: embark(
+                client, item.get('file_name') or os.path.basename(item['s3_key']),
+                source_bucket, item['s3_key'], item['assessment_id'], target_bucket
+            ),
+            source_bucket
+        )
+
+    if not s3_key or not assessment_id:
+        logger.error("Missing required keys: 's3_key' or 'assessment_id'")
+        return {
+            'statusCode': 400,
+            'body': "Missing required keys: 's3_key' or 'assessment_id'"
+        }
+
+    try:
+        result = embark(s3_client, file_name, source_bucket, s3_key, assessment_id, target_bucket)
+        logger.info(f"{file_name} Embark File Processed.")
+        return result
+
+    except Exception as e:
+        logger.error(f"Error processing {file_name} Embark: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': f"Error processing {file_name} Embark: {str(e)}"
+        }
@@ -1,29 +1,21 @@
 import pandas as pd
-import boto3
-from io import StringIO
+from aws_clients import lazy_client
 import logging
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor
+from s3_utils import read_s3_csv, write_s3_csv, input_fingerprint, is_output_current, fingerprint_metadata, S3PrefixIndex
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-s3_client = boto3.client('s3')
-dynamodb_client = boto3.client('dynamodb')
+s3_client = lazy_client('s3')
+dynamodb_client = lazy_client('dynamodb')
 
+# Bump when the transform logic changes so existing outputs are rebuilt
+TRANSFORM_VERSION = '1'
 
-def read_s3_csv(s3_client, bucket_name, object_key):
-    """Utility function to read CSV from S3."""
-    obj = s3_client.get_object(Bucket=bucket_name, Key=object_key)
-    return pd.read_csv(StringIO(obj['Body'].read().decode('utf-8')))
-
-
-def check_file_exists(s3_client, bucket, key):
-    """Check if a file exists in S3 with retry logic."""
-    logger.info(f"Checking existence of file: {bucket}/{key}")
-    s3_client.head_object(Bucket=bucket, Key=key)
-    
 
 def read_and_clean_s3_csv(s3_client, bucket_name, object_key, retain_columns=None):
     """Read CSV from S3 and clean column names."""
@@ -46,39 +38,63 @@ def read_and_clean_s3_csv(s3_client, bucket_name, object_key, retain_columns=Non
     return df
 
 
-def get_Force_Flow(s3_client, bucket_source, assessment_id, target_bucket, retain_columns=None):
+def force_flow_inputs(bucket_source, assessment_id, target_bucket):
+    """Return the (bucket, key) inputs of get_Force_Flow: AssessmentTable, POS and RD_I_PaxLocationAll."""
+    return [
+        (bucket_source, f'assessments/{assessment_id}/cos-calculators/AssessmentTable.csv'),
+        (target_bucket, f'assessments/{assessment_id}/POS.csv'),
+        (bucket_source, f'assessments/{assessment_id}/cos-calculators/cos-i-subsistence/output/RD_I_PaxLocationAll.csv')
+    ]
+
+
+def join_inputs(bucket_source, assessment_id, target_bucket):
+    """Return the (bucket, key) inputs of get_joins: POS followed by the four files joined to it."""
+    return [
+        (bucket_source, f'assessments/{assessment_id}/POS.csv'),
+        (target_bucket, f'assessments/{assessment_id}/cos-calculators/cos-i-water/output/RD_IW_PaxLocationAll.csv'),
+        (bucket_source, f'assessments/{assessment_id}/cos-calculators/cos-i-water/output/RD_IW_Ration_Costs.csv'),
+        (bucket_source, f'assessments/{assessment_id}/cos-calculators/cos-i-subsistence/output/RD_I_POS_Location.csv'),
+        (bucket_source, f'assessments/{assessment_id}/cos-calculators/cos-i-subsistence/output/RD_I_Ration_Costs.csv')
+    ]
+
+
+def prefetch_inputs(executor, s3_client, inputs, retain_columns):
+    """Start reading each distinct input on the executor, keyed by (bucket, key).
+
+    Prefetched frames are shared and must not be modified in place.
+    """
+    return {
+        (bucket_name, object_key): executor.submit(read_and_clean_s3_csv, s3_client, bucket_name, object_key, retain_columns)
+        for bucket_name, object_key in dict.fromkeys(inputs)
+    }
+
+
+def get_input_frames(s3_client, inputs, retain_columns, executor=None):
+    """Return the cleaned frames for `inputs`, read concurrently when an executor is given.
+
+    Called only once a step knows its outputs need rebuilding, so a step that skips
+    never submits or waits on a read.
+    """
+    if executor is None:
+        return [read_and_clean_s3_csv(s3_client, bucket_name, object_key, retain_columns) for bucket_name, object_key in inputs]
+    frames = prefetch_inputs(executor, s3_client, inputs, retain_columns)
+    return [frames[(bucket_name, object_key)].result() for bucket_name, object_key in inputs]
+
+
+def get_Force_Flow(s3_client, bucket_source, assessment_id, target_bucket, retain_columns=None, executor=None, index=None):
   
     if retain_columns is None:
         retain_columns = []
         
     # Define file paths
-    input_file_path1 = f'assessments/{assessment_id}/cos-calculators/AssessmentTable.csv'
-    input_file_path2 = f'assessments/{assessment_id}/POS.csv'
-    input_file_path3 = f'assessments/{assessment_id}/cos-calculators/cos-i-subsistence/output/RD_I_PaxLocationAll.csv'
+    inputs = force_flow_inputs(bucket_source, assessment_id, target_bucket)
     output_file_path = f'assessments/{assessment_id}/ForceFlow_joined.csv'
 
-    logger.info(f"Input file paths being checked: {bucket_source}/{input_file_path1}, {target_bucket}/{input_file_path2}, {bucket_source}/{input_file_path3}")
-
-    # Check for the existence of the ForceFlow_joined.csv file
-    try:
-        s3_client.head_object(Bucket=target_bucket, Key=output_file_path)
-        logger.info("ForceFlow_joined.csv file already exists")
-        return {
-            'statusCode': 200,
-            'body': 'File already exists, no action taken.',
-            's3_file_path': f's3://{target_bucket}/{output_file_path}'
-        }
-    except s3_client.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            logger.info("ForceFlow_joined.csv file does not exist, creating...")
-        else:
-            raise
+    logger.info(f"Input file paths being checked: {', '.join(f'{bucket}/{key}' for bucket, key in inputs)}")
 
-    # Check for files 
+    # Fingerprint the input files; missing inputs are reported before any work is done
     try:
-        check_file_exists(s3_client, bucket_source, input_file_path1)
-        check_file_exists(s3_client, target_bucket, input_file_path2)
-        check_file_exists(s3_client, bucket_source, input_file_path3)
+        fingerprint = input_fingerprint(s3_client, inputs, TRANSFORM_VERSION, index)
     except s3_client.exceptions.ClientError as e:
         if e.response['Error']['Code'] == '404':
             logger.error("One or more of the input files do not exist.")
@@ -88,11 +104,19 @@ def get_Force_Flow(s3_client, bucket_source, assessment_id, target_bucket, retai
             }
         else:
             raise
+
+    # Skip only when the existing ForceFlow_joined.csv file was built from these exact inputs
+    if is_output_current(s3_client, target_bucket, output_file_path, fingerprint, index):
+        logger.info("ForceFlow_joined.csv file is up to date")
+        return {
+            'statusCode': 200,
+            'body': 'File already exists, no action taken.',
+            's3_file_path': f's3://{target_bucket}/{output_file_path}'
+        }
+    logger.info("ForceFlow_joined.csv file does not exist or is stale, creating...")
             
     # Read data from S3
-    df1 = read_and_clean_s3_csv(s3_client, bucket_source, input_file_path1, retain_columns)
-    df2 = read_and_clean_s3_csv(s3_client, target_bucket, input_file_path2, retain_columns)
-    df3 = read_and_clean_s3_csv(s3_client, bucket_source, input_file_path3, retain_columns)
+    df1, df2, df3 = get_input_frames(s3_client, inputs, retain_columns, executor)
 
     # Merge dataframes
     df4 = pd.merge(df3, df1, on='AssessmentNumber', how='left')
@@ -118,9 +142,7 @@ def get_Force_Flow(s3_client, bucket_source, assessment_id, target_bucket, retai
 
     
     # Convert DataFrame to CSV and upload to S3
-    csv_buffer = StringIO()
-    df5.to_csv(csv_buffer, index=False)
-    s3_client.put_object(Bucket=target_bucket, Key=output_file_path, Body=csv_buffer.getvalue())
+    write_s3_csv(s3_client, df5, target_bucket, output_file_path, metadata=fingerprint_metadata(fingerprint, TRANSFORM_VERSION))
     logger.info("Joined ForceFlow CSV file has been uploaded to S3.")
 
     return {
@@ -130,41 +152,19 @@ def get_Force_Flow(s3_client, bucket_source, assessment_id, target_bucket, retai
     }
 
 
-def get_joins(s3_client, bucket_source, assessment_id, target_bucket, retain_columns):
+def get_joins(s3_client, bucket_source, assessment_id, target_bucket, retain_columns, executor=None, index=None):
     # Define file paths
-    input_file_path1 = f'assessments/{assessment_id}/POS.csv'
-    input_file_path2 = f'assessments/{assessment_id}/cos-calculators/cos-i-water/output/RD_IW_PaxLocationAll.csv'
-    input_file_path3 = f'assessments/{assessment_id}/cos-calculators/cos-i-water/output/RD_IW_Ration_Costs.csv'
-    input_file_path4 = f'assessments/{assessment_id}/cos-calculators/cos-i-subsistence/output/RD_I_POS_Location.csv'
-    input_file_path5 = f'assessments/{assessment_id}/cos-calculators/cos-i-subsistence/output/RD_I_Ration_Costs.csv'
+    inputs = join_inputs(bucket_source, assessment_id, target_bucket)
     output_file_path2 = f'assessments/{assessment_id}/RD_IW_PaxLocationAll_joined.csv'
     output_file_path3 = f'assessments/{assessment_id}/RD_IW_Ration_Costs_joined.csv'
     output_file_path4 = f'assessments/{assessment_id}/RD_I_POS_Location_joined.csv'
     output_file_path5 = f'assessments/{assessment_id}/RD_I_Ration_Costs_joined.csv'
 
-    logger.info(f"Input file paths being checked: {bucket_source}/{input_file_path1}, {target_bucket}/{input_file_path2}, {bucket_source}/{input_file_path3}, {bucket_source}/{input_file_path4}, {bucket_source}/{input_file_path5}")
-
-    # Check for the existence of the joined files
-    try:
-        s3_client.head_object(Bucket=target_bucket, Key=output_file_path2)
-        s3_client.head_object(Bucket=target_bucket, Key=output_file_path3)
-        s3_client.head_object(Bucket=target_bucket, Key=output_file_path4)
-        s3_client.head_object(Bucket=target_bucket, Key=output_file_path5)
-        logger.info("Files already exist")
-        return
-    except s3_client.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            logger.info("Files do not exist, creating...")
-        else:
-            raise
+    logger.info(f"Input file paths being checked: {', '.join(f'{bucket}/{key}' for bucket, key in inputs)}")
 
-    # Check for files 
+    # Fingerprint the input files; missing inputs are reported before any work is done
     try:
-        check_file_exists(s3_client, bucket_source, input_file_path1)
-        check_file_exists(s3_client, target_bucket, input_file_path2)
-        check_file_exists(s3_client, bucket_source, input_file_path3)
-        check_file_exists(s3_client, bucket_source, input_file_path4)
-        check_file_exists(s3_client, bucket_source, input_file_path5)
+        fingerprint = input_fingerprint(s3_client, inputs, TRANSFORM_VERSION, index)
     except s3_client.exceptions.ClientError as e:
         if e.response['Error']['Code'] == '404':
             logger.error("One or more of the input files do not exist.")
@@ -174,13 +174,16 @@ def get_joins(s3_client, bucket_source, assessment_id, target_bucket, retain_col
             }
         else:
             raise
+
+    # Skip only when every joined file was built from these exact inputs
+    output_paths = [output_file_path2, output_file_path3, output_file_path4, output_file_path5]
+    if all(is_output_current(s3_client, target_bucket, path, fingerprint, index) for path in output_paths):
+        logger.info("Joined files are up to date")
+        return
+    logger.info("Joined files do not exist or are stale, creating...")
             
     # Read data from S3
-    df1 = read_and_clean_s3_csv(s3_client, bucket_source, input_file_path1, retain_columns)
-    df2 = read_and_clean_s3_csv(s3_client, target_bucket, input_file_path2, retain_columns)
-    df3 = read_and_clean_s3_csv(s3_client, bucket_source, input_file_path3, retain_columns)
-    df4 = read_and_clean_s3_csv(s3_client, bucket_source, input_file_path4, retain_columns)
-    df5 = read_and_clean_s3_csv(s3_client, bucket_source, input_file_path5, retain_columns) 
+    df1, df2, df3, df4, df5 = get_input_frames(s3_client, inputs, retain_columns, executor)
     
     # Log DataFrame columns before renaming
     logger.info(f"DataFrame columns before renaming: {df2.columns.tolist()}")
@@ -195,8 +198,8 @@ def get_joins(s3_client, bucket_source, assessment_id, target_bucket, retain_col
         'Drinking_rqmt': 'Drinking_Rqmt'
     }
     
-    # Rename the columns in the DataFrame
-    df2.rename(columns=rename_dict, inplace=True)
+    # Rename the columns in the DataFrame (a copy, as the prefetched frame is shared)
+    df2 = df2.rename(columns=rename_dict)
     df2 = df2.drop(columns=['V7', 'V8', 'V9'], errors='ignore')
     
     # Create new columns that sum the aggregations by day for Inflow, Potable_Rqmt, NonPotable_Rqmt, and Drinking_Rqmt
@@ -216,10 +219,9 @@ def get_joins(s3_client, bucket_source, assessment_id, target_bucket, retain_col
     df9 = pd.merge(df5, df1, how='left', left_on='DOS_Period', right_on='DOS')
     
     # Convert and upload joined files to S3
-    for idx, (df, output_path) in enumerate(zip([df6, df7, df8, df9], [output_file_path2, output_file_path3, output_file_path4, output_file_path5])):
-        csv_buffer = StringIO()
-        df.to_csv(csv_buffer, index=False)
-        s3_client.put_object(Bucket=target_bucket, Key=output_path, Body=csv_buffer.getvalue())
+    metadata = fingerprint_metadata(fingerprint, TRANSFORM_VERSION)
+    for idx, (df, output_path) in enumerate(zip([df6, df7, df8, df9], output_paths)):
+        write_s3_csv(s3_client, df, target_bucket, output_path, metadata=metadata)
         logger.info(f"{output_path} file has been uploaded to S3.")
 
     return {
@@ -246,15 +248,22 @@ def lambda_handler(event, context):
                    'Ration_Cost', 'UI_Count', 'UI_Cost', 'CAP_Name', 'CAP_Names', 
                    'Total_UI_Cost']
 
-        ff_response = get_Force_Flow(s3_client, bucket_source, assessment_id, target_bucket, retain_columns)
-        if not ff_response:
-            logger.error("get_Force_Flow returned None or an invalid response.")
-            return {
-                'statusCode': 500,
-                'body': 'Error: get_Force_Flow failed'
-            }
+        # One listing per bucket of the assessment prefix answers every existence/ETag lookup
+        index = S3PrefixIndex(s3_client, f'assessments/{assessment_id}/')
+
+        # Each step reads its inputs concurrently, and only after finding an output to rebuild
+        max_workers = max(len(force_flow_inputs(bucket_source, assessment_id, target_bucket)), len(join_inputs(bucket_source, assessment_id, target_bucket)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            ff_response = get_Force_Flow(s3_client, bucket_source, assessment_id, target_bucket, retain_columns, executor, index)
+            if not ff_response:
+                logger.error("get_Force_Flow returned None or an invalid response.")
+                return {
+                    'statusCode': 500,
+                    'body': 'Error: get_Force_Flow failed'
+                }
+
+            join_response = get_joins(s3_client, bucket_source, assessment_id, target_bucket, retain_columns, executor, index)
 
-        join_response = get_joins(s3_client, bucket_source, assessment_id, target_bucket, retain_columns)
         if not join_response:
             logger.error("get_joins returned None or an invalid response.")
             return {
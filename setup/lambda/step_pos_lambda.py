@@ -1,28 +1,19 @@
 import pandas as pd
-import boto3
-from io import StringIO
+from aws_clients import lazy_client
 import logging
 import json
+from s3_utils import read_s3_csv, write_s3_csv, input_fingerprint, is_output_current, fingerprint_metadata, S3PrefixIndex
 
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-s3_client = boto3.client('s3')
-dynamodb_client = boto3.client('dynamodb')
+s3_client = lazy_client('s3')
+dynamodb_client = lazy_client('dynamodb')
 
-
-def read_s3_csv(s3_client, bucket_name, object_key):
-    """Utility function to read CSV from S3."""
-    obj = s3_client.get_object(Bucket=bucket_name, Key=object_key)
-    return pd.read_csv(StringIO(obj['Body'].read().decode('utf-8')))
-
-
-def check_file_exists(s3_client, bucket, key):
-    """Check if a file exists in S3 with retry logic."""
-    logger.info(f"Checking existence of file: {bucket}/{key}")
-    s3_client.head_object(Bucket=bucket, Key=key)
+# Bump when the transform logic changes so existing outputs are rebuilt
+TRANSFORM_VERSION = '1'
 
 
 def get_POS(s3_client, source_bucket, assessment_id, target_bucket):
@@ -31,21 +22,15 @@ def get_POS(s3_client, source_bucket, assessment_id, target_bucket):
     input_file_path2 = f'assessments/{assessment_id}/cos-calculators/AssessmentParameterDataMapTable.csv'
     output_file_path = f'assessments/{assessment_id}/POS.csv'
 
-    # Check for the existence of the POS.CSV file
-    try:
-        s3_client.head_object(Bucket=target_bucket, Key=output_file_path)
-        logger.info("POS.csv file already exists")
-        return
-    except s3_client.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            logger.info("POS.csv file does not exist, creating...")
-        else:
-            raise
+    # One listing of the assessment prefix answers the input and output lookups
+    index = S3PrefixIndex(s3_client, f'assessments/{assessment_id}/')
 
-    # Check for files to be available with retry logic
+    # Fingerprint the input files; missing inputs are reported before any work is done
     try:
-        check_file_exists(s3_client, source_bucket, input_file_path1)
-        check_file_exists(s3_client, source_bucket, input_file_path2)
+        fingerprint = input_fingerprint(s3_client, [
+            (source_bucket, input_file_path1),
+            (source_bucket, input_file_path2)
+        ], TRANSFORM_VERSION, index)
     except s3_client.exceptions.ClientError as e:
         if e.response['Error']['Code'] == '404':
             logger.error("One or both of the input files do not exist.")
@@ -56,6 +41,12 @@ def get_POS(s3_client, source_bucket, assessment_id, target_bucket):
         else:
             raise
 
+    # Skip only when the existing POS.csv file was built from these exact inputs
+    if is_output_current(s3_client, target_bucket, output_file_path, fingerprint, index):
+        logger.info("POS.csv file is up to date")
+        return
+    logger.info("POS.csv file does not exist or is stale, creating...")
+
     df1 = read_s3_csv(s3_client, source_bucket, object_key=input_file_path1)
     df2 = read_s3_csv(s3_client, source_bucket, object_key=input_file_path2)
 
@@ -78,9 +69,7 @@ def get_POS(s3_client, source_bucket, assessment_id, target_bucket):
     pos_df = pd.DataFrame(new_data)
 
     # Convert DataFrame to CSV and upload to S3
-    csv_buffer = StringIO()
-    pos_df.to_csv(csv_buffer, index=False)  # Use index=False to match the expected format
-    s3_client.put_object(Bucket=target_bucket, Key=output_file_path, Body=csv_buffer.getvalue())
+    write_s3_csv(s3_client, pos_df, target_bucket, output_file_path, metadata=fingerprint_metadata(fingerprint, TRANSFORM_VERSION))
     logger.info("POS.csv file has been uploaded to S3.")
 
     # Return the S3 file path
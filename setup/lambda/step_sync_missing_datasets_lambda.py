@@ -2,21 +2,22 @@ import os
 import json
 import logging
 from datetime import datetime
-import boto3
+from aws_clients import lazy_client, lazy_resource
 import re
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key, Attr
 from tenacity import retry, stop_after_attempt, wait_fixed
+from s3_utils import S3PrefixIndex
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # Initialize clients
-dynamodb_client = boto3.client('dynamodb')
-s3_client = boto3.client('s3')
-quicksight_client = boto3.client('quicksight')
-dynamodb_resource = boto3.resource('dynamodb', region_name='us-east-1')
+dynamodb_client = lazy_client('dynamodb')
+s3_client = lazy_client('s3')
+quicksight_client = lazy_client('quicksight')
+dynamodb_resource = lazy_resource('dynamodb', region_name='us-east-1')
 
 # Configuration
 dynamodb_table = os.getenv('DYNAMODB_TABLE', 'imat-dashboard-datasets')
@@ -84,18 +85,13 @@ def construct_dataset_id(object_key, assessment_id):
     return dataset_id
 
 
-def check_s3_object(bucket_name, object_key, assessment_id):
+def check_s3_object(bucket_name, object_key, assessment_id, index):
     """Check if the S3 object exists, return the dataset_id if object_key found."""
-    try:
-        s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    if index.exists(bucket_name, object_key):
         s3_dataset_id = construct_dataset_id(object_key, assessment_id)
         return s3_dataset_id
-    except s3_client.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            logger.warning(f'Object {object_key} not found in bucket {bucket_name}')
-            return None
-        else:
-            raise
+    logger.warning(f'Object {object_key} not found in bucket {bucket_name}')
+    return None
 
 
 def check_dynamodb_object(dynamodb_table, dataset_id, assessment_id):
@@ -152,6 +148,10 @@ def check_all_embark_keys_against_dynamodb(assessment_id, s3_client, dynamodb_re
     missing_dynamodb_matches = []
     synced_keys = []
 
+    # One paginated listing of the assessment prefix replaces a head_object per key;
+    # rebuilt on every retry so newly written files are seen
+    index = S3PrefixIndex(s3_client, f'assessments/{assessment_id}/')
+
     try:
         for s3_uri, dataset_id in lookup_table.items():
             s3_path = s3_uri.replace("s3://", "")
@@ -159,7 +159,7 @@ def check_all_embark_keys_against_dynamodb(assessment_id, s3_client, dynamodb_re
 
             try:
                 # Check S3 Object
-                s3_dataset_id = check_s3_object(bucket_name, object_key, assessment_id)
+                s3_dataset_id = check_s3_object(bucket_name, object_key, assessment_id, index)
                 if not s3_dataset_id:
                     # Check DynamoDB Object
                     dynamodb_dataset_id = check_dynamodb_object(dynamodb_table, dataset_id, assessment_id)